@@ -0,0 +1,194 @@
+"""
+File: generate_data.py
+Description: Writes synthetic method results, config and gene lists for benchmarks
+"""
+import numpy as np
+import pandas as pd
+import argparse
+import os
+
+# cancer type names used for the synthetic results
+CANCER_TYPES = ['BLCA', 'BRCA', 'CESC', 'COAD', 'GBM', 'HNSC', 'KIRC',
+                'KIRP', 'LAML', 'LGG', 'LIHC', 'LUAD', 'LUSC', 'OV',
+                'PAAD', 'PRAD', 'READ', 'SKCM', 'STAD', 'THCA', 'UCEC']
+
+# threshold column, cutoff and direction cycled through the synthetic methods
+THRESHOLDS = [('qvalue', 0.05, 'low'),
+              ('pvalue', 1e-4, 'low'),
+              ('score', 0.999, 'high'),
+              ('rank', 50, 'high')]
+
+MAF_COLS = ['Hugo_Symbol', 'Variant_Classification', 'Tumor_Sample_Barcode', 'CODE']
+VARIANT_CLASSES = ['Missense_Mutation', 'Missense_Mutation', 'Missense_Mutation',
+                   'Nonsense_Mutation', 'Frame_Shift_Del', 'Silent', 'Silent',
+                   "3'UTR", 'Intron']
+
+
+def cancer_type_names(num_cancer_types):
+    """Get PANCAN plus num_cancer_types cancer type names."""
+    names = []
+    for i in range(num_cancer_types):
+        name = CANCER_TYPES[i % len(CANCER_TYPES)]
+        if i >= len(CANCER_TYPES):
+            name += str(i // len(CANCER_TYPES))
+        names.append(name)
+    return ['PANCAN'] + names
+
+
+def method_result(rng, genes, num_genes):
+    """Create a random result table for one method and cancer type."""
+    gene_ix = rng.choice(len(genes), num_genes, replace=False)
+
+    # a few strong signals on top of uniform p-values
+    pvals = rng.uniform(size=num_genes)
+    num_signal = max(1, num_genes // 50)
+    pvals[:num_signal] = pvals[:num_signal] ** 8
+    pvals[rng.uniform(size=num_genes) < 0.001] = 0.0
+    rank = pvals.argsort().argsort() + 1
+    qvals = np.minimum(1.0, pvals * num_genes / rank)
+    filt = np.where(rng.uniform(size=num_genes) < 0.02, 'FAIL', 'PASS')
+    df = pd.DataFrame({'gene': genes.take(gene_ix),
+                       'transcript': ['ENST{0:011d}'.format(i) for i in gene_ix],
+                       'protein_change': rng.randint(1, 1000, size=num_genes),
+                       'info': np.char.add(np.char.add('FILTER=', filt), ';'),
+                       'pvalue': pvals,
+                       'qvalue': qvals,
+                       'score': 1 - pvals},
+                      columns=['gene', 'transcript', 'protein_change', 'info',
+                               'pvalue', 'qvalue', 'score'])
+    return df
+
+
+def write_config(path, methods):
+    """Write a YAML config for the synthetic methods."""
+    lines = ['exclude:', '    - HotSpot3D']
+    for method_name, (col, cutoff, top) in methods:
+        lines += ['{0}:'.format(method_name),
+                  '    level: gene',
+                  '    threshold:',
+                  '        {0}: {1}'.format(col, cutoff),
+                  '        top: {0}'.format(top)]
+    with open(path, 'w') as handle:
+        handle.write('\n'.join(lines) + '\n')
+
+
+def write_gene_lists(output_dir, rng, genes, list_size):
+    """Write CGC-like and plain reference gene lists."""
+    paths = {}
+    cgc_genes = genes.take(rng.choice(len(genes), list_size, replace=False))
+    cgc_df = pd.DataFrame({'Gene Symbol': cgc_genes,
+                           'Mutation Types': 'Mis, N',
+                           'Tumour Types(Somatic)': 'lung'},
+                          columns=['Gene Symbol', 'Mutation Types', 'Tumour Types(Somatic)'])
+    paths['cgc'] = os.path.join(output_dir, 'cgc.tsv')
+    cgc_df.to_csv(paths['cgc'], sep='\t', index=False)
+    for name in ['landscapes', 'kandoth', 'high_confidence_list']:
+        list_genes = genes.take(rng.choice(len(genes), list_size, replace=False))
+        paths[name] = os.path.join(output_dir, name + '.txt')
+        with open(paths[name], 'w') as handle:
+            handle.write('\n'.join(list_genes) + '\n')
+    return paths
+
+
+def write_maf(path, rng, genes, cancer_types, samples_per_type, muts_per_sample):
+    """Write a minimal MAF file with mutations for each cancer type."""
+    num_types = len(cancer_types)
+    num_muts = num_types * samples_per_type * muts_per_sample
+    sample_ix = np.repeat(np.arange(num_types * samples_per_type), muts_per_sample)
+    type_ix = sample_ix // samples_per_type
+    ctypes = np.array(cancer_types).take(type_ix)
+    samples = np.char.add(np.char.add(ctypes, '-S'), sample_ix.astype(str))
+    df = pd.DataFrame({'Hugo_Symbol': genes.take(rng.randint(len(genes), size=num_muts)),
+                       'Variant_Classification': np.array(VARIANT_CLASSES).take(
+                           rng.randint(len(VARIANT_CLASSES), size=num_muts)),
+                       'Tumor_Sample_Barcode': samples,
+                       'CODE': ctypes},
+                      columns=MAF_COLS)
+    df.to_csv(path, sep='\t', index=False)
+
+
+def generate(output_dir,
+             num_methods=8,
+             num_cancer_types=5,
+             num_genes=20000,
+             genes_per_file=2000,
+             list_size=500,
+             samples_per_type=50,
+             muts_per_sample=100,
+             seed=101):
+    """Write a synthetic benchmark data set.
+
+    The output directory gets an input/<method>/<CANCER>.txt tree of
+    method results, a config.yaml, four reference gene lists and a MAF
+    file. A method named HotSpot3D is always included, since consensus
+    expects it.
+
+    Returns
+    -------
+    paths : dict
+        path of the input directory, config, gene lists and MAF file
+    """
+    rng = np.random.RandomState(seed)
+    genes = np.array(['GENE{0:05d}'.format(i) for i in range(num_genes)], dtype=object)
+    genes_per_file = min(genes_per_file, num_genes)
+    cancer_types = cancer_type_names(num_cancer_types)
+
+    # method results
+    methods = [('HotSpot3D', ('rank', 50, 'high'))]
+    for i in range(num_methods - 1):
+        methods.append(('method{0}'.format(i+1), THRESHOLDS[i % len(THRESHOLDS)]))
+    input_dir = os.path.join(output_dir, 'input')
+    for method_name, _ in methods:
+        method_dir = os.path.join(input_dir, method_name)
+        if not os.path.exists(method_dir): os.makedirs(method_dir)
+        for ctype in cancer_types:
+            df = method_result(rng, genes, genes_per_file)
+            df.to_csv(os.path.join(method_dir, ctype+'.txt'), sep='\t', index=False)
+
+    paths = {'input_dir': input_dir,
+             'config': os.path.join(output_dir, 'config.yaml'),
+             'mutations': os.path.join(output_dir, 'mutations.maf')}
+    write_config(paths['config'], methods)
+    paths.update(write_gene_lists(output_dir, rng, genes, list_size))
+    write_maf(paths['mutations'], rng, genes, cancer_types[1:],
+              samples_per_type, muts_per_sample)
+    return paths
+
+
+def parse_arguments():
+    info = 'Writes synthetic method results for benchmarking'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-o', '--output',
+                        type=str, required=True,
+                        help='Output directory')
+    parser.add_argument('--methods',
+                        type=int, default=8,
+                        help='Number of methods (Default: 8)')
+    parser.add_argument('--cancer-types',
+                        type=int, default=5,
+                        help='Number of cancer types besides PANCAN (Default: 5)')
+    parser.add_argument('--genes',
+                        type=int, default=20000,
+                        help='Number of distinct genes (Default: 20000)')
+    parser.add_argument('--genes-per-file',
+                        type=int, default=2000,
+                        help='Number of genes in each result file (Default: 2000)')
+    parser.add_argument('--seed',
+                        type=int, default=101,
+                        help='Random seed (Default: 101)')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main(opts):
+    generate(opts['output'],
+             num_methods=opts['methods'],
+             num_cancer_types=opts['cancer_types'],
+             num_genes=opts['genes'],
+             genes_per_file=opts['genes_per_file'],
+             seed=opts['seed'])
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
@@ -0,0 +1,163 @@
+"""
+File: run_benchmarks.py
+Description: Times the driver_protocol sub-commands and standard_plots on synthetic data
+"""
+import argparse
+import subprocess
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+import generate_data
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROTOCOL_SCRIPT = os.path.join(REPO_DIR, 'protocol', 'protocol.py')
+PLOTS_SCRIPT = os.path.join(REPO_DIR, 'protocol', 'standard_plots.py')
+
+# keyword arguments of generate_data.generate for each scale
+SCALES = {
+    'small': dict(num_methods=4, num_cancer_types=3, num_genes=2000,
+                  genes_per_file=500, samples_per_type=20, muts_per_sample=50),
+    'medium': dict(num_methods=10, num_cancer_types=10, num_genes=20000,
+                   genes_per_file=5000, samples_per_type=100, muts_per_sample=100),
+    'large': dict(num_methods=25, num_cancer_types=30, num_genes=20000,
+                  genes_per_file=20000, samples_per_type=300, muts_per_sample=200),
+}
+SCALE_ORDER = ['small', 'medium', 'large']
+
+# sub-commands in the order they are benchmarked, consensus reads the
+# outputs of the earlier ones
+COMMANDS = ['num_signif', 'list_overlap', 'pvalue', 'method_overlap',
+            'consensus', 'standard_plots']
+
+
+def command_args(command, paths, out_dir):
+    """Get the command line for a benchmarked command."""
+    lists = ['-c', paths['cgc'], '-landscapes', paths['landscapes'],
+             '-k', paths['kandoth'], '-hcd', paths['high_confidence_list']]
+    if command == 'standard_plots':
+        return ([sys.executable, PLOTS_SCRIPT,
+                 '-i', paths['input_dir'], '-config', paths['config'],
+                 '-m', paths['mutations'], '-o', os.path.join(out_dir, 'plots')] + lists)
+    args = [sys.executable, PROTOCOL_SCRIPT, command, '-config', paths['config'],
+            '-o', out_dir]
+    if command == 'consensus':
+        args += ['-m', os.path.join(out_dir, 'mlfc_scores.txt'),
+                 '-outlier', os.path.join(out_dir, 'outliers.txt'),
+                 '-do', os.path.join(out_dir, 'driver_list_overlap.txt'),
+                 '-k', out_dir]
+    else:
+        args += ['-i', paths['input_dir']]
+    if command in ['list_overlap', 'pvalue']:
+        args += lists
+    return args
+
+
+def time_command(args, log_path):
+    """Run a command in a child process and measure it.
+
+    Returns
+    -------
+    result : dict
+        wall time and CPU time in seconds, peak resident memory in MB and
+        the exit code of the child process
+    """
+    with open(log_path, 'a') as log_handle:
+        start = time.time()
+        proc = subprocess.Popen(args, stdout=log_handle, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.time() - start
+    # ru_maxrss is in kilobytes on linux, but bytes on mac
+    maxrss = usage.ru_maxrss / 1024.0
+    if sys.platform == 'darwin':
+        maxrss /= 1024.0
+    return {'wall_time': wall,
+            'cpu_time': usage.ru_utime + usage.ru_stime,
+            'peak_rss_mb': maxrss,
+            'returncode': os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1}
+
+
+def run_scale(scale, work_dir, commands, repeat):
+    """Generate the data for one scale and benchmark every command."""
+    data_dir = os.path.join(work_dir, scale)
+    start = time.time()
+    paths = generate_data.generate(data_dir, **SCALES[scale])
+    gen_time = time.time() - start
+
+    out_dir = os.path.join(data_dir, 'output')
+    if not os.path.exists(out_dir): os.makedirs(out_dir)
+    log_path = os.path.join(data_dir, 'benchmark.log')
+    results = []
+    for command in commands:
+        args = command_args(command, paths, out_dir)
+        runs = [time_command(args, log_path) for i in range(repeat)]
+        best = min(runs, key=lambda r: r['wall_time'])
+        best['scale'] = scale
+        best['command'] = command
+        best['repeat'] = repeat
+        results.append(best)
+        print('{0:8s} {1:16s} {2:9.2f}s {3:9.2f}s {4:9.1f}MB {5}'.format(
+            scale, command, best['wall_time'], best['cpu_time'],
+            best['peak_rss_mb'], 'ok' if best['returncode'] == 0 else 'FAILED'))
+        sys.stdout.flush()
+    return {'scale': scale,
+            'parameters': SCALES[scale],
+            'generate_time': gen_time,
+            'results': results}
+
+
+def parse_arguments():
+    info = 'Benchmarks the driver_protocol sub-commands on synthetic data'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-s', '--scales',
+                        nargs='+', default=['small', 'medium'],
+                        choices=SCALE_ORDER,
+                        help='Data set sizes to benchmark (Default: small medium)')
+    parser.add_argument('-c', '--commands',
+                        nargs='+', default=COMMANDS,
+                        choices=COMMANDS,
+                        help='Commands to benchmark (Default: all)')
+    parser.add_argument('-r', '--repeat',
+                        type=int, default=1,
+                        help='Number of runs per command, the fastest is '
+                        'reported (Default: 1)')
+    parser.add_argument('-w', '--work-dir',
+                        type=str, default=None,
+                        help='Directory for the synthetic data and outputs, '
+                        'kept after the run (Default: temporary directory)')
+    parser.add_argument('-o', '--output',
+                        type=str, default='benchmark_results.json',
+                        help='JSON file with the results (Default: benchmark_results.json)')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main(opts):
+    work_dir = opts['work_dir']
+    is_tmp = work_dir is None
+    if is_tmp:
+        work_dir = tempfile.mkdtemp(prefix='protocol_bench_')
+
+    try:
+        print('{0:8s} {1:16s} {2:>10s} {3:>10s} {4:>11s}'.format(
+            'scale', 'command', 'wall', 'cpu', 'peak rss'))
+        scales = [s for s in SCALE_ORDER if s in opts['scales']]
+        all_results = [run_scale(s, work_dir, opts['commands'], opts['repeat'])
+                       for s in scales]
+    finally:
+        if is_tmp:
+            shutil.rmtree(work_dir)
+
+    output = {'python': sys.version.split()[0],
+              'platform': sys.platform,
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'scales': all_results}
+    with open(opts['output'], 'w') as handle:
+        json.dump(output, handle, indent=2)
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
@@ -0,0 +1,69 @@
+"""
+File: startup_time.py
+Description: Checks that the command line tools start up quickly
+"""
+import argparse
+import subprocess
+import time
+import sys
+import os
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROTOCOL_SCRIPT = os.path.join(REPO_DIR, 'protocol', 'protocol.py')
+PLOTS_SCRIPT = os.path.join(REPO_DIR, 'protocol', 'standard_plots.py')
+
+# command lines that should return without importing heavy modules
+COMMANDS = [
+    [PROTOCOL_SCRIPT, '--help'],
+    [PROTOCOL_SCRIPT, 'list_overlap', '--help'],
+    [PROTOCOL_SCRIPT, 'consensus'],  # missing required arguments
+    [PLOTS_SCRIPT, '--help'],
+]
+
+
+def median_time(args, repeat):
+    """Median wall time of running a command, in seconds."""
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat):
+            start = time.time()
+            subprocess.call(args, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    times.sort()
+    return times[len(times)//2]
+
+
+def parse_arguments():
+    info = 'Checks the start up time of driver_protocol and standard_plots'
+    parser = argparse.ArgumentParser(description=info)
+    parser.add_argument('-r', '--repeat',
+                        type=int, default=11,
+                        help='Number of runs per command (Default: 11)')
+    parser.add_argument('-m', '--max-time',
+                        type=float, default=0.1,
+                        help='Maximum median time in seconds (Default: 0.1)')
+    args = parser.parse_args()
+    return vars(args)
+
+
+def main(opts):
+    # time of starting python itself, for reference
+    base_time = median_time([sys.executable, '-c', 'pass'], opts['repeat'])
+    print('{0:7.3f}s  python -c pass'.format(base_time))
+
+    is_slow = False
+    for cmd in COMMANDS:
+        cmd_time = median_time([sys.executable] + cmd, opts['repeat'])
+        is_slow = is_slow or cmd_time > opts['max_time']
+        status = 'ok' if cmd_time <= opts['max_time'] else 'SLOW'
+        cmd_str = ' '.join([os.path.basename(cmd[0])] + cmd[1:])
+        print('{0:7.3f}s  {1} ({2})'.format(cmd_time, cmd_str, status))
+
+    if is_slow:
+        print('Start up takes longer than {0}s'.format(opts['max_time']))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    opts = parse_arguments()
+    main(opts)
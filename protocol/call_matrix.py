@@ -0,0 +1,170 @@
+"""
+File: call_matrix.py
+Description: Compact cancer type x gene x method array of significant calls
+"""
+import numpy as np
+import pandas as pd
+import gene_sets
+
+# number of set bits for each possible byte
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class CallMatrix(object):
+    """Significant genes of every method and cancer type.
+
+    Gene names are interned in a GeneIndex, and the calls are held in a
+    boolean array of shape (cancer types, genes, methods), so per-gene
+    work across methods and cancer types becomes array operations. The
+    gene axis follows the ids of the gene index.
+
+    Parameters
+    ----------
+    genes : pd.Index
+        gene names, one per position along the gene axis
+    methods : list
+        method names, one per position along the method axis
+    cancer_types : list
+        cancer type names, one per position along the cancer type axis
+    calls : np.ndarray
+        boolean array, True if a method finds a gene significant in a
+        cancer type
+    reported : np.ndarray
+        boolean (cancer types, methods) array, True if a method has
+        results for a cancer type
+    """
+
+    def __init__(self, genes, methods, cancer_types, calls, reported):
+        self.genes = pd.Index(genes)
+        self.methods = list(methods)
+        self.cancer_types = list(cancer_types)
+        self.calls = calls
+        self.reported = reported
+
+    @classmethod
+    def from_signif_dict(cls, signif_dict, methods=None, gene_index=None):
+        """Create a call matrix from {method: {cancer type: gene list}}."""
+        if methods is None:
+            methods = list(signif_dict)
+        if gene_index is None:
+            gene_index = gene_sets.GeneIndex()
+
+        # intern gene and cancer type names
+        cancer_types = []
+        gene_ids = {}
+        for m in methods:
+            for c in signif_dict[m]:
+                if c not in cancer_types:
+                    cancer_types.append(c)
+                gene_ids[(m, c)] = gene_index.intern(list(signif_dict[m][c]))
+        genes = pd.Index(gene_index.symbols[:len(gene_index)])
+
+        # fill in the calls
+        calls = np.zeros((len(cancer_types), len(genes), len(methods)), dtype=bool)
+        reported = np.zeros((len(cancer_types), len(methods)), dtype=bool)
+        for j, m in enumerate(methods):
+            for i, c in enumerate(cancer_types):
+                if c not in signif_dict[m]: continue
+                reported[i, j] = True
+                calls[i, gene_ids[(m, c)], j] = True
+        return cls(genes, methods, cancer_types, calls, reported)
+
+    @classmethod
+    def from_frames(cls, call_dict, gene_index=None):
+        """Create a call matrix from gene by method data frames of 0/1 calls,
+        one per cancer type (e.g. the *.overlap.txt files)."""
+        if gene_index is None:
+            gene_index = gene_sets.GeneIndex()
+        cancer_types = list(call_dict)
+        methods = []
+        gene_ids = {}
+        for c in cancer_types:
+            methods += [m for m in call_dict[c].columns if m not in methods]
+            gene_ids[c] = gene_index.intern(list(call_dict[c].index))
+        genes = pd.Index(gene_index.symbols[:len(gene_index)])
+
+        calls = np.zeros((len(cancer_types), len(genes), len(methods)), dtype=bool)
+        reported = np.zeros((len(cancer_types), len(methods)), dtype=bool)
+        for i, c in enumerate(cancer_types):
+            df = call_dict[c]
+            gene_ix = gene_ids[c]
+            for m in df.columns:
+                j = methods.index(m)
+                reported[i, j] = True
+                calls[i, gene_ix, j] = df[m].values > 0
+        return cls(genes, methods, cancer_types, calls, reported)
+
+    def subset_methods(self, methods):
+        """Get a call matrix restricted to the given methods."""
+        method_ix = [self.methods.index(m) for m in methods]
+        return CallMatrix(self.genes, methods, self.cancer_types,
+                          self.calls[:, :, method_ix],
+                          self.reported[:, method_ix])
+
+    def num_significant(self):
+        """Number of significant genes as a cancer type by method data frame.
+
+        Cancer types a method did not report are NaN.
+        """
+        counts = self.calls.sum(axis=1).astype(float)
+        counts[~self.reported] = np.nan
+        return pd.DataFrame(counts, index=self.cancer_types, columns=self.methods)
+
+    def overlap_counts(self, gene_masks):
+        """Number of significant genes within each of several gene sets.
+
+        The calls and gene sets are packed into bitsets along the gene
+        axis, so all counts come from a single AND plus popcount.
+
+        Parameters
+        ----------
+        gene_masks : np.ndarray
+            boolean (gene sets, genes) array marking the genes in each set
+
+        Returns
+        -------
+        counts : np.ndarray
+            (cancer types, methods, gene sets) array of overlap counts
+        """
+        packed_calls = np.packbits(self.calls, axis=1)
+        packed_masks = np.packbits(gene_masks, axis=1)
+        both = packed_calls[:, np.newaxis, :, :] & packed_masks[np.newaxis, :, :, np.newaxis]
+        counts = POPCOUNT.take(both).sum(axis=2, dtype=np.int64)
+        return counts.transpose(0, 2, 1)
+
+    def num_overlap(self, gene_mask):
+        """Number of significant genes within a gene set, as a cancer type
+        by method data frame.
+
+        Parameters
+        ----------
+        gene_mask : np.ndarray
+            boolean array along the gene axis marking genes in the set
+        """
+        counts = self.overlap_counts(gene_mask[np.newaxis, :])[:, :, 0]
+        return pd.DataFrame(counts, index=self.cancer_types, columns=self.methods)
+
+    def to_frame(self, cancer_type):
+        """Gene by method data frame of 0/1 calls for one cancer type.
+
+        Only genes called by at least one method are included.
+        """
+        i = self.cancer_types.index(cancer_type)
+        ctype_calls = self.calls[i]
+        is_called = ctype_calls.any(axis=1)
+        return pd.DataFrame(ctype_calls[is_called].astype(int),
+                            index=self.genes[is_called],
+                            columns=self.methods)
+
+    def method_overlap_count(self):
+        """For each method, the number of methods calling each of its genes.
+
+        The count is the maximum across cancer types where the method
+        calls the gene. Genes a method never calls are NaN.
+        """
+        num_calls = self.calls.sum(axis=2)
+        max_counts = np.where(self.calls, num_calls[:, :, np.newaxis], 0).max(axis=0)
+        max_counts = max_counts.astype(float)
+        max_counts[max_counts == 0] = np.nan
+        output_df = pd.DataFrame(max_counts, index=self.genes, columns=self.methods)
+        return output_df.dropna(how='all').sort_index()
@@ -1,68 +1,287 @@
 import pandas as pd
+import numpy as np
+from scipy import stats
+import multiprocessing
+import zlib
 import os
-from collections import Counter
 import utils
+import config as cfg
+import gene_sets
+import profiling
+import call_matrix
 
 # logging
 import logging
 logger = logging.getLogger(__name__)
 
-def num_cgc_overlap(signif_genes, cancer_type, cgc_list):
-    """Intersect significant genes with CGC or other driver gene list."""
-    cgc_result = {}
-    for method in signif_genes:
-        mygenes = signif_genes[method].get(cancer_type, [])
-        intersect = len(set(mygenes) & set(cgc_list))
-        cgc_result[method] = intersect
-    return cgc_result
-
-
 def read_custom_list(path):
     """Read in a custom driver gene list."""
-    with open(path) as handle:
+    with utils.open_input(path, text=True) as handle:
         gene_list = [l.strip() for l in handle]
+    profiling.record_read(path, rows=len(gene_list))
     return gene_list
 
 
-def main(opts):
-    logger.info('Running list_overlap sub-command . . .')
-    config = utils.load_config(opts['config'])
+# command line option and display name of each reference gene list
+REFERENCE_LISTS = [('cgc', 'CGC'),
+                   ('landscapes', 'Landscapes'),
+                   ('kandoth', 'Kandoth et al.'),
+                   ('high_confidence_list', 'Tamborero et al.'),
+                   ('gene_list', 'Custom List')]
 
-    # get the significant genes for each method
-    signif_dict = utils.fetch_significant(opts['input_dir'],
-                                          config)
-    num_methods = len(signif_dict)
 
-    # read in driver genes
-    driver_list_names = ['cgc', 'landscapes', 'kandoth',
-                         'high_confidence_list', 'gene_list']
-    driver_genes = set()
-    for l in driver_list_names:
+def read_reference_lists(opts, gene_index):
+    """Read the reference driver gene lists provided on the command line.
+
+    Parameters
+    ----------
+    opts : dict
+        command line options
+    gene_index : gene_sets.GeneIndex
+        interning table for gene symbols
+
+    Returns
+    -------
+    ref_lists : gene_sets.ReferenceLists
+        reference lists, in the order of REFERENCE_LISTS
+    """
+    ref_lists = gene_sets.ReferenceLists(gene_index)
+    for opt_name, list_name in REFERENCE_LISTS:
         # skip if list not provided
-        if opts[l] is None: continue
+        if opts.get(opt_name) is None: continue
 
-        # add genes to list
-        if l == 'cgc':
+        if opt_name == 'cgc':
             # get cgc genes
-            driver_genes |= set(utils.process_cgc(opts['cgc']))
-            list_name = 'CGC'
+            ref_lists.add(list_name, utils.process_cgc(opts[opt_name]))
         else:
             # read in custom driver gene list
-            driver_genes |= set(read_custom_list(opts[l]))
-            list_name = 'Custom List'
-    driver_genes = list(driver_genes)
+            ref_lists.add(list_name, read_custom_list(opts[opt_name]))
+    return ref_lists
 
-    all_overlap_list = []
-    cancer_types = signif_dict[signif_dict.keys()[0]].keys()
-    for cancer_type in cancer_types:
-        # count the overlap
-        num_cgc_dict = num_cgc_overlap(signif_dict, cancer_type, driver_genes)
-        num_signif_dict = {k: len(signif_dict[k].get(cancer_type, []))
-                           for k in signif_dict}
 
+def tested_genes(store, calls):
+    """Get the genes reported by each method and cancer type, which are
+    the gene universe for enrichment tests.
+
+    Returns
+    -------
+    tested : call_matrix.CallMatrix
+        call matrix marking every gene in each result file, over the same
+        gene ids, methods and cancer types as calls
+    """
+    gene_ids = {}
+    for j, method_name in enumerate(calls.methods):
+        tested_dict = store.fetch_tested_genes(method_name)
+        for cancer_type in tested_dict:
+            i = calls.cancer_types.index(cancer_type)
+            ids = store.gene_index.intern_array(tested_dict[cancer_type])
+            gene_ids[(i, j)] = ids[ids >= 0]
+
+    num_genes = len(store.gene_index)
+    is_tested = np.zeros((len(calls.cancer_types), num_genes, len(calls.methods)), dtype=bool)
+    for (i, j), ids in gene_ids.items():
+        is_tested[i, ids, j] = True
+    return call_matrix.CallMatrix(store.gene_index.symbols[:num_genes], calls.methods,
+                                  calls.cancer_types, is_tested, calls.reported)
+
+
+def _permutation_worker(task):
+    """Count how often random gene sets overlap a list at least as much as
+    the significant genes of one method in one cancer type.
+
+    Each permutation draws as many genes as the method found significant,
+    without replacement, from the genes the method tested. Only the
+    number of drawn genes with each pattern of list membership matters,
+    so these counts are drawn directly, one pattern at a time, each from
+    a hypergeometric distribution conditional on the earlier patterns.
+    This is exact and takes time in proportion to the number of
+    patterns rather than genes. Each cell has its own random stream
+    seeded by the method and cancer type names. Run by the process pool
+    in list_enrichment.
+    """
+    seed, method_name, cancer_type, pattern_lists, pattern_counts, num_draw, overlap, num_perm = task
+    rng = np.random.RandomState([seed,
+                                 zlib.crc32(method_name.encode('utf-8')) & 0xffffffff,
+                                 zlib.crc32(cancer_type.encode('utf-8')) & 0xffffffff])
+    left_draw = np.empty(num_perm, dtype=np.int64)
+    left_draw[:] = num_draw
+    left_genes = pattern_counts.sum()
+    null_overlap = np.zeros((num_perm, pattern_lists.shape[1]), dtype=np.int64)
+    for in_lists, num_genes in zip(pattern_lists, pattern_counts):
+        if num_genes == left_genes:
+            # last pattern, every gene left is drawn from it
+            drawn = left_draw
+        else:
+            # numpy can not draw zero genes
+            drawn = np.zeros(num_perm, dtype=np.int64)
+            is_left = left_draw > 0
+            if is_left.any():
+                drawn[is_left] = rng.hypergeometric(num_genes, left_genes - num_genes,
+                                                    left_draw[is_left])
+        null_overlap[:, in_lists] += drawn[:, np.newaxis]
+        left_draw = left_draw - drawn
+        left_genes -= num_genes
+    return (null_overlap >= overlap).sum(axis=0)
+
+
+def list_enrichment(calls, tested, ref_lists, num_perm=0, seed=101, jobs=1):
+    """Test whether the significant genes of each method are enriched for
+    genes in each reference list.
+
+    The universe is the set of genes a method reports in a cancer type.
+    Exact hypergeometric p-values for every method, cancer type and list
+    come from a single scipy.stats.hypergeom call. If num_perm is above
+    zero, a permutation p-value is also computed from random gene sets,
+    with one seeded random stream per method and cancer type so results
+    do not depend on the number of processes.
+
+    Parameters
+    ----------
+    calls : call_matrix.CallMatrix
+        significant genes
+    tested : call_matrix.CallMatrix
+        genes reported by each method, see tested_genes
+    ref_lists : gene_sets.ReferenceLists
+        reference gene lists, the union is tested as "Any list" when
+        there is more than one
+    num_perm : int
+        number of permutations
+    seed : int
+        random seed for the permutations
+    jobs : int
+        number of processes used for the permutations
+
+    Returns
+    -------
+    enrich_df : pd.DataFrame
+        one row per method, cancer type and list
+    """
+    list_masks = ref_lists.masks(len(tested.genes))
+    list_names = list(ref_lists.names)
+    if len(list_names) > 1:
+        list_masks = np.vstack([list_masks, list_masks.any(axis=0)])
+        list_names.append('Any list')
+
+    # (cancer type, method, list) arrays of counts
+    num_tested = tested.calls.sum(axis=1)[:, :, np.newaxis]
+    num_signif = calls.calls.sum(axis=1)[:, :, np.newaxis]
+    num_in_list = tested.overlap_counts(list_masks)
+    overlap = calls.overlap_counts(list_masks[:, :len(calls.genes)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = num_signif * num_in_list / num_tested.astype(float)
+        fold = overlap / expected
+    pvals = stats.hypergeom.sf(overlap - 1, num_tested, num_in_list, num_signif)
+
+    # permutation null
+    if num_perm > 0:
+        # number of tested genes with each pattern of list membership,
+        # one task per method and cancer type with genes to draw
+        gene_patterns = (list_masks.astype(np.int64) << np.arange(len(list_masks))[:, np.newaxis]).sum(axis=0)
+        num_extreme = np.empty(overlap.shape, dtype=int)
+        num_extreme[:] = num_perm
+        cells, tasks = [], []
+        for i, cancer_type in enumerate(calls.cancer_types):
+            for j, method_name in enumerate(calls.methods):
+                patterns, pattern_counts = np.unique(gene_patterns[tested.calls[i, :, j]],
+                                                     return_counts=True)
+                num_draw = min(num_signif[i, j, 0], pattern_counts.sum())
+                if num_draw == 0:
+                    continue
+                pattern_lists = (patterns[:, np.newaxis] >> np.arange(len(list_masks))) & 1
+                cells.append((i, j))
+                tasks.append((seed, method_name, cancer_type, pattern_lists.astype(bool),
+                              pattern_counts, num_draw, overlap[i, j], num_perm))
+        if jobs > 1:
+            with profiling.child_cpu():
+                pool = multiprocessing.Pool(jobs)
+                try:
+                    cell_extreme = pool.map(_permutation_worker, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+        else:
+            cell_extreme = [_permutation_worker(t) for t in tasks]
+        for (i, j), extreme in zip(cells, cell_extreme):
+            num_extreme[i, j] = extreme
+        perm_pvals = (1.0 + num_extreme) / (1.0 + num_perm)
+
+    # one row per reported method, cancer type and list
+    shape = overlap.shape
+    ct_ix, meth_ix, list_ix = [a.ravel() for a in np.indices(shape)]
+    is_reported = calls.reported[ct_ix, meth_ix]
+    enrich_df = pd.DataFrame({
+        'method': np.array(calls.methods, dtype=object)[meth_ix],
+        'CODE': np.array(calls.cancer_types, dtype=object)[ct_ix],
+        'list': np.array(list_names, dtype=object)[list_ix],
+        '# significant': np.broadcast_to(num_signif, shape).ravel(),
+        '# tested': np.broadcast_to(num_tested, shape).ravel(),
+        '# tested in list': num_in_list.ravel(),
+        '# overlap': overlap.ravel(),
+        'expected overlap': expected.ravel(),
+        'fold enrichment': fold.ravel(),
+        'hypergeometric p-value': pvals.ravel(),
+    }, columns=['method', 'CODE', 'list', '# significant', '# tested',
+                '# tested in list', '# overlap', 'expected overlap',
+                'fold enrichment', 'hypergeometric p-value'])
+    if num_perm > 0:
+        enrich_df['permutation p-value'] = perm_pvals.ravel()
+    enrich_df = enrich_df[is_reported].sort_values(['method', 'CODE'], kind='mergesort')
+    return enrich_df.reset_index(drop=True)
+
+
+def threshold_sweep(store, driver_genes, num_points):
+    """Count significant genes and driver list overlap over a grid of
+    thresholds for every method and cancer type.
+
+    Returns
+    -------
+    sweep_df : pd.DataFrame
+        one row per method, cancer type and threshold
+    """
+    config = store.config
+    sweep_list = []
+    for method_name in cfg.fetch_level_names(config, level='gene'):
+        df_dict = store.fetch_raw_dataframes(method_name)
+        grid = utils.threshold_grid(df_dict, method_name, config, num_points)
+        curves = store.fetch_single_method_significant(method_name, thresholds=grid,
+                                                       driver_genes=driver_genes)
+        for cancer_type in curves:
+            curve_df = curves[cancer_type]
+            curve_df.insert(0, 'CODE', cancer_type)
+            curve_df.insert(0, 'method', method_name)
+            sweep_list.append(curve_df)
+    sweep_df = pd.concat(sweep_list, ignore_index=True)
+    frac = sweep_df['num_overlap'].astype(float) / sweep_df['num_significant']
+    sweep_df['fraction_overlap'] = frac.fillna(0)
+    return sweep_df
+
+
+def main(opts, store=None):
+    logger.info('Running list_overlap sub-command . . .')
+    if store is None:
+        config = utils.load_config(opts['config'])
+        store = utils.open_result_store(opts, config)
+    config = store.config
+
+    # get the significant genes for each method
+    calls = store.fetch_call_matrix(level='gene')
+
+    # read in driver genes
+    ref_lists = read_reference_lists(opts, store.gene_index)
+    list_name = 'CGC' if ref_lists.names == ['CGC'] else 'Custom List'
+
+    # count the overlap with the union of lists for all methods and cancer types
+    with profiling.stage('overlap'):
+        driver_mask = ref_lists.masks(len(calls.genes)).any(axis=0)
+        num_cgc_df = calls.num_overlap(driver_mask)
+        num_signif_df = calls.num_significant().fillna(0).astype(int)
+
+    all_overlap_list = []
+    for cancer_type in calls.cancer_types:
         # format result
-        overlap_df = pd.DataFrame({'# '+list_name: pd.Series(num_cgc_dict),
-                                '# significant': pd.Series(num_signif_dict)})
+        overlap_df = pd.DataFrame({'# '+list_name: num_cgc_df.loc[cancer_type],
+                                   '# significant': num_signif_df.loc[cancer_type]})
+        overlap_df = overlap_df.sort_index()
         frac_ovlp_col = 'Fraction overlap ({0})'.format(list_name)
         overlap_df[frac_ovlp_col] = overlap_df['# '+list_name].astype(float) / overlap_df['# significant']
         overlap_df[frac_ovlp_col] = overlap_df[frac_ovlp_col].fillna(0)
@@ -74,10 +293,33 @@ def main(opts):
         if opts['plot']:
             import plot_data
             cgc_path = os.path.join(opts['output'], cancer_type+'.driver_list_overlap.pdf')
-            plot_data.cgc_overlap(overlap_df, cgc_path, list_name)
+            with profiling.stage('plotting'):
+                plot_data.cgc_overlap(overlap_df, cgc_path, list_name)
 
     # save result
     cgc_path = os.path.join(opts['output'], 'driver_list_overlap.txt')
-    pd.concat(all_overlap_list).to_csv(cgc_path, sep='\t')
+    all_overlap_df = pd.concat(all_overlap_list)
+    with profiling.stage('writing'):
+        all_overlap_df.to_csv(cgc_path, sep='\t')
+
+    # enrichment for each reference list
+    with profiling.stage('enrichment'):
+        tested = tested_genes(store, calls)
+        enrich_df = list_enrichment(calls, tested, ref_lists,
+                                    num_perm=opts.get('permutations', 0),
+                                    seed=opts.get('seed', 101),
+                                    jobs=store.jobs)
+    enrich_path = os.path.join(opts['output'], 'driver_list_enrichment.txt')
+    with profiling.stage('writing'):
+        enrich_df.to_csv(enrich_path, sep='\t', index=False)
+
+    # significance curves over a grid of thresholds
+    if opts.get('threshold_sweep'):
+        logger.info('Sweeping significance thresholds . . .')
+        sweep_df = threshold_sweep(store, ref_lists.union_genes(), opts['threshold_sweep'])
+        sweep_path = os.path.join(opts['output'], 'threshold_sweep.txt')
+        with profiling.stage('writing'):
+            sweep_df.to_csv(sweep_path, sep='\t', index=False)
 
     logger.info('Finished list_overlap sub-command.')
+    return all_overlap_df
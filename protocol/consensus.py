@@ -6,100 +6,207 @@ Github: ctokheim
 Description: Creates a driver gene consensus amongst methods
 """
 import pandas as pd
+import numpy as np
 from collections import Counter
 import csv
 import os
 import glob
+import call_matrix
+import profiling
+
+# methods that are less reliable if they fail a single criterion
+LIMITED_METHODS = [#'NetBox-snv',
+                   #'OncoIMPACT-snv',
+                   #'DriverNet-snv',
+                   'HotSpot3D',
+                   ]
+
 
 def read_outliers(mypath):
     """Read which cancer types are outliers for each method."""
     with open(mypath) as handle:
         myreader = csv.reader(handle, delimiter='\t')
         outliers = {line[0]: line[1].split(',') for line in myreader}
+    profiling.record_read(mypath, rows=len(outliers))
     return outliers
 
 
-def main(opts):
-    # read in mlfc/outliers
-    if opts['mlfc']:
-        mlfc_df = pd.read_table(opts['mlfc'], index_col=0)
-        mlfc_med = mlfc_df.median(axis=1)
-        mlfc_q1 = mlfc_df.quantile(.25, axis=1)
-        #import IPython ; IPython.embed()
-        #mlfc_bad = mlfc_df.apply(lambda x, m: x>=m, args=(1,), axis=1)
-    #rename_dict = {'Unnamed: 0': 'method'}
-    if opts['driver_overlap']:
-        driver_ovlp_df = pd.read_table(opts['driver_overlap'], index_col=0) # .rename(columns=rename_dict)
-        driver_meds = driver_ovlp_df.groupby('CODE')['Fraction overlap (Custom List)'].median()
-        driver_q3 = driver_ovlp_df.groupby('CODE')['Fraction overlap (Custom List)'].quantile(.75)
-    if opts['outlier']:
-        outliers = read_outliers(opts['outlier'])
-        counts = Counter([c for k in outliers for c in outliers[k]])
-        # outlier if majority of methods agree
-        outlier_cancer_types = [c
-                                for c in counts
-                                if counts[c]>=(len(outliers)/2)]
-
-    # iterate over all cancer types/PANCAN
-    score_list = []
-    pattern = os.path.join(opts['cocall'], '*.overlap.txt')
-    # temporary hack
-    limited_methods = [#'NetBox-snv',
-                       #'OncoIMPACT-snv',
-                       #'DriverNet-snv',
-                       'HotSpot3D',
-                       ]
-    bad_method_list = []
+def read_cocalls(cocall_dir):
+    """Read the method overlap calls saved by the method_overlap sub-command."""
+    call_dict = {}
+    pattern = os.path.join(cocall_dir, '*.overlap.txt')
     for path in glob.glob(pattern):
         # file names are CANCER_TYPE.gene_overlap.txt
         cancer_type = os.path.basename(path).split('.')[0]
 
         # read in method overlap dataframe
-        df = pd.read_table(path, index_col=0)
+        call_dict[cancer_type] = pd.read_table(path, index_col=0)
+        profiling.record_read(path, rows=len(call_dict[cancer_type]))
+    return call_dict
+
+
+def read_inputs(opts, mlfc_df, driver_ovlp_df, outliers, calls):
+    """Read the inputs that were not passed in memory from the files given
+    on the command line."""
+    if mlfc_df is None and opts.get('mlfc'):
+        mlfc_df = pd.read_table(opts['mlfc'], index_col=0)
+        profiling.record_read(opts['mlfc'], rows=len(mlfc_df))
+    if driver_ovlp_df is None and opts.get('driver_overlap'):
+        driver_ovlp_df = pd.read_table(opts['driver_overlap'], index_col=0) # .rename(columns=rename_dict)
+        profiling.record_read(opts['driver_overlap'], rows=len(driver_ovlp_df))
+    if outliers is None and opts.get('outlier'):
+        outliers = read_outliers(opts['outlier'])
+    if calls is None:
+        calls = call_matrix.CallMatrix.from_frames(read_cocalls(opts['cocall']))
+    return mlfc_df, driver_ovlp_df, outliers, calls
+
+
+def method_weights(calls, mlfc_df, outliers, driver_ovlp_df):
+    """Decide which methods get a higher weight in each cancer type.
+
+    A method is less reliable in a cancer type if it has a high MLFC
+    (at least the median across methods), is an outlier in its number of
+    significant genes, or has a low overlap with the driver gene lists
+    (at most the median). Methods failing two criteria are less reliable,
+    or one criterion for PANCAN and the methods in LIMITED_METHODS. If a
+    majority of methods are outliers for a cancer type, no method there
+    is reliable. Every criterion is computed as a cancer type by method
+    array, so all cancer types are handled at once.
+
+    Parameters
+    ----------
+    calls : call_matrix.CallMatrix
+        significant calls of every method
+    mlfc_df : pd.DataFrame
+        MLFC score, cancer types by methods
+    outliers : dict
+        outlier cancer types of each method
+    driver_ovlp_df : pd.DataFrame
+        output of the list_overlap sub-command
+
+    Returns
+    -------
+    weights : np.ndarray
+        (cancer types, methods) array of weights for calls.methods
+    bad_meth_df : pd.DataFrame
+        method by cancer type table of less reliable methods, missing for
+        methods without any criteria in a cancer type
+    """
+    cancer_types = calls.cancer_types
+    frac_col = 'Fraction overlap (Custom List)'
+
+    # driver list overlap as a cancer type by method table
+    ovlp_df = pd.DataFrame({'method': driver_ovlp_df.index,
+                            'CODE': driver_ovlp_df['CODE'].values,
+                            'frac': driver_ovlp_df[frac_col].values,
+                            'listed': 1.0})
+    is_listed = ovlp_df.pivot(index='CODE', columns='method', values='listed')
+    ovlp_df = ovlp_df.pivot(index='CODE', columns='method', values='frac')
 
+    # each criterion is 0/1 for methods it covers, NaN otherwise
+    methods = sorted(set(mlfc_df.columns) | set(outliers) | set(ovlp_df.columns))
+    mlfc = mlfc_df.reindex(index=cancer_types).values.astype(float)
+    mlfc_med = np.nanmedian(mlfc, axis=1) if mlfc.size else np.zeros(len(cancer_types))
+    with np.errstate(invalid='ignore'):
+        bad_mlfc = (mlfc >= mlfc_med[:, np.newaxis]).astype(float)
+    bad_mlfc = pd.DataFrame(bad_mlfc, columns=mlfc_df.columns).reindex(columns=methods).values
+
+    is_outlier = np.array([[c in outliers[m] for m in outliers] for c in cancer_types],
+                          dtype=float).reshape(len(cancer_types), len(outliers))
+    is_outlier = pd.DataFrame(is_outlier, columns=list(outliers)).reindex(columns=methods).values
+
+    frac = ovlp_df.reindex(index=cancer_types, columns=methods).values.astype(float)
+    frac_med = np.nanmedian(frac, axis=1) if frac.size else np.zeros(len(cancer_types))
+    # a listed method with a missing overlap fraction is not less reliable
+    is_listed = is_listed.reindex(index=cancer_types, columns=methods).fillna(False).values.astype(bool)
+    with np.errstate(invalid='ignore'):
+        bad_ovlp = np.where(is_listed, (frac <= frac_med[:, np.newaxis]).astype(float), np.nan)
+
+    # combine the criteria, methods missing any criterion are not less reliable
+    is_present = ~(np.isnan(bad_mlfc) & np.isnan(is_outlier) & np.isnan(bad_ovlp))
+    num_bad = bad_mlfc + is_outlier + bad_ovlp
+    min_bad = np.where(np.array(cancer_types) == 'PANCAN', 1, 2)[:, np.newaxis]
+    min_bad = np.where(np.in1d(methods, LIMITED_METHODS)[np.newaxis, :], 1, min_bad)
+    with np.errstate(invalid='ignore'):
+        is_bad = num_bad >= min_bad
+
+    # outlier if majority of methods agree
+    counts = Counter([c for k in outliers for c in outliers[k]])
+    is_outlier_ctype = np.array([counts[c]>=(len(outliers)/2) for c in cancer_types], dtype=bool)
+    in_mlfc = np.in1d(methods, mlfc_df.columns)
+    is_present[is_outlier_ctype] = in_mlfc
+    is_bad[is_outlier_ctype] = True
+
+    # higher weight for reliable methods
+    is_good = pd.DataFrame(is_present & ~is_bad, columns=methods)
+    is_good = is_good.reindex(columns=calls.methods).fillna(False).values.astype(bool)
+    weights = np.where(is_good, 2, 1)
+
+    bad_meth = np.where(is_present, is_bad, None).astype(object)
+    bad_meth[~is_present] = np.nan
+    bad_meth_df = pd.DataFrame(bad_meth.T, index=methods, columns=cancer_types)
+    return weights, bad_meth_df
+
+
+def consensus_scores(calls, weights):
+    """Weighted number of methods calling each gene.
+
+    Parameters
+    ----------
+    calls : call_matrix.CallMatrix
+        significant calls of every method
+    weights : np.ndarray
+        (cancer types, methods) array of method weights
+
+    Returns
+    -------
+    score_df : pd.DataFrame
+        gene by cancer type scores, missing for genes no method calls in
+        a cancer type
+    """
+    scores = np.einsum('cgm,cm->gc', calls.calls, weights)
+    # weights are positive, so only called genes have a score
+    is_called = scores > 0
+    score_df = pd.DataFrame(np.where(is_called, scores, np.nan),
+                            index=calls.genes, columns=calls.cancer_types)
+    score_df = score_df[is_called.any(axis=1)].sort_index()
+
+    # keep integer scores for cancer types where every gene is called
+    for c in score_df.columns:
+        if not score_df[c].isnull().any():
+            score_df[c] = score_df[c].astype(int)
+    return score_df
+
+
+def main(opts, mlfc_df=None, outliers=None, driver_ovlp_df=None,
+         calls=None):
+    """Perform the consensus analysis.
+
+    Results from earlier sub-commands can be passed in memory. Any that
+    are not provided are read from the files given on the command line.
+    """
+    # read in mlfc/outliers
+    with profiling.stage('loading'):
+        mlfc_df, driver_ovlp_df, outliers, calls = read_inputs(opts, mlfc_df, driver_ovlp_df,
+                                                               outliers, calls)
+
+    with profiling.stage('scoring'):
         # add weighting unless said no by user
         if not opts['not_weighted']:
-            # figure out bad mlfc
-            #bad_mlfc = mlfc_df.ix[cancer_type] > 0
-            bad_mlfc = mlfc_df.ix[cancer_type] >= mlfc_med[cancer_type]
-
-            # figure out if an outlier
-            mydict = {}
-            for m in outliers:
-                mydict[m] = cancer_type in outliers[m]
-            outlier_series = pd.Series(mydict)
-
-            # figure if overlap problem
-            ovlp_series = driver_ovlp_df[driver_ovlp_df['CODE']==cancer_type]['Fraction overlap (Custom List)'] <= driver_meds.ix[cancer_type]
-
-            # combine the two criteria
-            if cancer_type in outlier_cancer_types:
-                bad_method = pd.Series({i: True for i in bad_mlfc.index})
-            elif cancer_type == 'PANCAN':
-                tmp = (bad_mlfc.astype(int) + outlier_series.astype(int) + ovlp_series.astype(int))
-                bad_method = tmp > 0
-            else:
-                tmp = (bad_mlfc.astype(int) + outlier_series.astype(int) + ovlp_series.astype(int))
-                bad_method = tmp > 1
-                bad_method[limited_methods] = tmp[limited_methods] > 0
-            good_methods = bad_method[~bad_method].index.tolist()
-            #good_methods = [g for g in good_methods if g not in hack_remove]
-
-            # make multiplier adjustment
-            df.loc[:, good_methods] = 2 * df[good_methods]
-
-            bad_method.name = cancer_type
-            bad_method_list.append(bad_method)
+            weights, bad_meth_df = method_weights(calls, mlfc_df, outliers, driver_ovlp_df)
+        else:
+            weights = np.ones((len(calls.cancer_types), len(calls.methods)), dtype=int)
+            bad_meth_df = None
 
         # calculate score
-        score = df.sum(axis=1)
-        score.name = cancer_type
-        score_list.append(score)
+        full_score_df = consensus_scores(calls, weights)
 
     # save results
-    full_score_df = pd.concat(score_list, axis=1)
-    out_path = os.path.join(opts['output'], 'consensus.txt')
-    full_score_df.to_csv(out_path, sep='\t')
-    bad_meth_df = pd.concat(bad_method_list, axis=1)
-    out_path = os.path.join(opts['output'], 'less_reliable.txt')
-    bad_meth_df.to_csv(out_path, sep='\t')
+    with profiling.stage('writing'):
+        out_path = os.path.join(opts['output'], 'consensus.txt')
+        full_score_df.to_csv(out_path, sep='\t')
+        if bad_meth_df is not None:
+            out_path = os.path.join(opts['output'], 'less_reliable.txt')
+            bad_meth_df.to_csv(out_path, sep='\t')
+
+    return full_score_df
@@ -0,0 +1,143 @@
+"""
+File: consistency.py
+Description: TopDrop consistency between results on split or replicate data
+"""
+import pandas as pd
+import numpy as np
+import multiprocessing
+import os
+import utils
+import eval_stats
+import profiling
+import config as cfg
+
+# logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def fetch_pvalue_cols(config, method_name):
+    """Get the p-value columns used to rank genes for a method."""
+    if cfg.is_valid_config(config, method_name, 'consistency'):
+        return config[method_name]['consistency']
+    else:
+        return ['pvalue']
+
+
+def read_ranking_pvalues(path, pval_cols, cache=None):
+    """Read the p-values used for ranking genes, indexed by gene.
+
+    The smallest p-value across the p-value columns is used.
+    """
+    df = utils.read_method_file(path, cache=cache)
+    missing_cols = [p for p in pval_cols if p not in df.columns]
+    if missing_cols:
+        raise ValueError('P-value columns not found in {0}: {1}. Please specify '
+                         'the correct name in the config file.'.format(path, ', '.join(missing_cols)))
+    pvals = df[pval_cols].apply(pd.to_numeric, errors='coerce').min(axis=1)
+    pvals.index = df['gene'].values
+    return pvals
+
+
+def _consistency_worker(task):
+    """Compute the TopDrop curve of one method and cancer type.
+
+    Run by the process pool in consistency_curves.
+    """
+    method_name, cancer_type, path1, path2, pval_cols, max_depth, cache = task
+    with profiling.collect_reads() as reads:
+        pvals1 = read_ranking_pvalues(path1, pval_cols, cache=cache)
+        pvals2 = read_ranking_pvalues(path2, pval_cols, cache=cache)
+    if pvals1.isnull().all() or pvals2.isnull().all():
+        # method does not report p-values
+        curve = None
+    else:
+        curve = eval_stats.top_drop_curve(pvals1, pvals2, max_depth)
+    return method_name, cancer_type, curve, reads
+
+
+def consistency_curves(input_dir1, input_dir2, config, max_depth,
+                       jobs=1, cache=None):
+    """Compute TopDrop overlap at depths 1 to max_depth for every method
+    and cancer type with results in both directories.
+
+    Returns
+    -------
+    curve_df : pd.DataFrame
+        one row per method and cancer type, one column per depth
+    """
+    # match up result files of the two directories
+    tasks = []
+    for method_name in cfg.fetch_level_names(config, level='gene'):
+        pval_cols = fetch_pvalue_cols(config, method_name)
+        if not os.path.isdir(os.path.join(input_dir1, method_name)): continue
+        if not os.path.isdir(os.path.join(input_dir2, method_name)): continue
+        files2 = dict(utils.list_method_files(input_dir2, method_name))
+        for cancer_type, path1 in utils.list_method_files(input_dir1, method_name):
+            if cancer_type not in files2: continue
+            tasks.append((method_name, cancer_type, path1, files2[cancer_type],
+                          pval_cols, max_depth, cache))
+
+    # compare each method and cancer type
+    logger.info('Comparing {0} pairs of result files with {1} processes . . .'.format(len(tasks), jobs))
+    if jobs > 1:
+        with profiling.child_cpu():
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(_consistency_worker, tasks)
+            finally:
+                pool.close()
+                pool.join()
+    else:
+        results = [_consistency_worker(t) for t in tasks]
+
+    rows = []
+    curves = []
+    for method_name, cancer_type, curve, reads in results:
+        profiling.add_reads(reads)
+        if curve is None: continue
+        rows.append((method_name, cancer_type))
+        curves.append(curve)
+    index = pd.MultiIndex.from_tuples(rows, names=['method', 'CODE']) if rows else None
+    curve_df = pd.DataFrame(np.array(curves).reshape(len(curves), max_depth),
+                            index=index,
+                            columns=np.arange(1, max_depth+1))
+    return curve_df.sort_index()
+
+
+def summarize_depth(curve_df, depth):
+    """Mean and standard error of the TopDrop overlap across cancer types
+    at a single depth, formatted for plot_data.consistency."""
+    depth_df = curve_df[depth].unstack('method')
+    summary_df = pd.DataFrame({'TopDrop {0} overlap mean'.format(depth): depth_df.mean(),
+                               'TopDrop {0} overlap sem'.format(depth): depth_df.sem()})
+    return summary_df
+
+
+def main(opts):
+    logger.info('Running consistency sub-command . . .')
+    config = utils.load_config(opts['config'])
+    store = utils.open_result_store(opts, config)
+
+    # TopDrop overlap for all depths
+    with profiling.stage('consistency'):
+        curve_df = consistency_curves(store.input_dir, opts['second_input_dir'],
+                                      config, opts['depth'],
+                                      jobs=store.jobs, cache=store.cache)
+        summary_df = summarize_depth(curve_df, opts['depth'])
+
+    # save results
+    with profiling.stage('writing'):
+        out_path = os.path.join(opts['output'], 'consistency.txt')
+        curve_df.to_csv(out_path, sep='\t')
+        out_path = os.path.join(opts['output'], 'consistency_summary.txt')
+        summary_df.to_csv(out_path, sep='\t')
+
+    if opts['plot']:
+        import plot_data
+        plot_path = os.path.join(opts['output'], 'consistency.pdf')
+        with profiling.stage('plotting'):
+            plot_data.consistency(summary_df, opts['depth'], plot_path)
+
+    logger.info('Finished consistency sub-command.')
+    return curve_df
@@ -4,6 +4,10 @@ import pandas as pd
 import utils
 import sys
 
+# QQ plots of more p-values than this are thinned, see thin_qq_points
+QQ_MAX_POINTS = 2000
+QQ_TAIL_POINTS = 500
+
 
 def top_drop_overlap(s1, s2, depth):
     # get gene of interest by specified depth
@@ -125,3 +129,190 @@ def mean_log_fold_change(data):
     dist_quant = np.arange(1, len(tmp)+1)/float(len(tmp))
     mlfc = np.mean(np.abs(np.log2(tmp/dist_quant)))
     return mlfc
+
+
+def batch_mean_log_fold_change(values, offsets, is_sorted=False):
+    """Compute the mean log fold change for many p-value vectors at once.
+
+    The p-value vectors are concatenated into a single array, so all
+    scores come from one segmented sort and a few array operations
+    instead of a loop over vectors.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        p-values of all vectors, concatenated
+    offsets : np.ndarray
+        start of each vector within values, followed by len(values)
+    is_sorted : bool
+        each vector is already sorted, so the sort is skipped
+
+    Returns
+    -------
+    mlfc : np.ndarray
+        score for each vector, NaN for empty vectors
+    """
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    num_groups = len(lengths)
+    mlfc = np.empty(num_groups)
+    mlfc[:] = np.nan
+    if len(values) == 0:
+        return mlfc
+    group = np.repeat(np.arange(num_groups), lengths)
+
+    # segmented sort: sort by value within each vector
+    if is_sorted:
+        tmp = values.copy()
+    else:
+        tmp = values[np.lexsort((values, group))]
+
+    # avoid infinity in log by avoiding zero pvals
+    is_nonempty = lengths > 0
+    starts = offsets[:-1][is_nonempty]
+    pos_vals = np.where(tmp > 0, tmp, np.inf)
+    min_pos = np.empty(num_groups)
+    min_pos[is_nonempty] = np.minimum.reduceat(pos_vals, starts)
+    min_pos[np.isinf(min_pos)] = np.nan
+    is_zero = tmp == 0
+    tmp[is_zero] = min_pos[group[is_zero]]
+
+    # compare against the expected quantiles
+    rank = np.arange(1, len(tmp)+1) - offsets[group]
+    dist_quant = rank / lengths[group].astype(float)
+    log_ratio = np.abs(np.log2(tmp/dist_quant))
+    sums = np.bincount(group, weights=log_ratio, minlength=num_groups)
+    mlfc[is_nonempty] = sums[is_nonempty] / lengths[is_nonempty]
+    return mlfc
+
+
+def _grid_positions(coord_at, num_coords, grid, pos):
+    """Correct approximate positions of grid values among increasing
+    coordinates to the positions np.searchsorted would give.
+
+    coord_at gives the coordinates at an array of indices, so only the
+    coordinates around each position are computed.
+    """
+    pos = np.clip(pos, 0, num_coords).astype(np.int64)
+    while True:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            move_left = (pos > 0) & (coord_at(np.maximum(pos-1, 0)) >= grid)
+            move_right = (pos < num_coords) & (coord_at(np.minimum(pos, num_coords-1)) < grid)
+        if not (move_left.any() or move_right.any()):
+            return pos
+        pos = pos - move_left + move_right
+
+
+def thin_qq_points(pvals, log=False,
+                   max_points=None,
+                   tail_points=QQ_TAIL_POINTS,
+                   is_sorted=False):
+    """Get the points of a qq-plot with the uniform distribution, keeping
+    at most about max_points of them.
+
+    The tail_points smallest p-values are always kept. The rest are
+    thinned to the points nearest to evenly spaced positions along each
+    axis, so the bulk near the diagonal is drawn with a bounded number
+    of points while departures from it are still visible.
+
+    Parameters
+    ----------
+    pvals : array-like
+        p-values
+    log : bool
+        thin evenly on a log scale, as used by qqplot(log=True)
+    max_points : int or None
+        maximum number of points, None keeps every point
+    is_sorted : bool
+        pvals are already sorted with missing values last, e.g. the
+        memory-mapped p-values of a pvalue_store cell. Only the kept
+        points are then read.
+
+    Returns
+    -------
+    expected : np.ndarray
+        expected p-values of the kept points
+    observed : np.ndarray
+        sorted observed p-values of the kept points
+    """
+    observed = pvals if is_sorted else np.sort(np.asarray(pvals, dtype=float))
+    num_pvals = len(observed)
+    if max_points is None or num_pvals <= max_points:
+        expected = np.arange(1, num_pvals+1)/float(num_pvals+1)
+        return expected, np.array(observed, dtype=float)
+
+    # coordinates along each axis, with the range of finite coordinates
+    # and the approximate position of a coordinate
+    expected_at = lambda ix: (ix + 1)/float(num_pvals+1)
+    if log:
+        first_obs = np.searchsorted(observed, 0, side='right')
+        axis_list = [(lambda ix: np.log10(expected_at(ix)), 0,
+                      lambda g: np.ceil((num_pvals+1)*10**g - 1)),
+                     (lambda ix: np.log10(observed[ix]), first_obs,
+                      lambda g: np.searchsorted(observed, 10**g))]
+    else:
+        first_obs = np.searchsorted(observed, -np.inf, side='right')
+        axis_list = [(expected_at, 0,
+                      lambda g: np.ceil((num_pvals+1)*g - 1)),
+                     (lambda ix: observed[ix], first_obs,
+                      lambda g: np.searchsorted(observed, g))]
+    last_list = [num_pvals - 1, np.searchsorted(observed, np.inf) - 1]
+
+    keep_list = [np.arange(min(tail_points, num_pvals)), [num_pvals-1]]
+    num_grid = max(max_points - tail_points, 2) // 2
+    for (coord_at, first, approx_pos), last in zip(axis_list, last_list):
+        # coordinates are sorted, so the nearest points are found at once
+        if first > last: continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lo, hi = coord_at(np.array([first, last]))
+        grid = np.linspace(lo, hi, num_grid)
+        pos = _grid_positions(coord_at, num_pvals, grid, approx_pos(grid))
+        keep_list.append(pos.clip(max=num_pvals-1))
+    keep_ix = np.unique(np.concatenate(keep_list).astype(np.int64))
+    return expected_at(keep_ix), np.asarray(observed[keep_ix], dtype=float)
+
+
+def top_drop_curve(pvals1, pvals2, max_depth):
+    """Compute the TopDrop overlap at every depth from 1 to max_depth.
+
+    At depth d, TopDrop is the fraction of the top d genes in the first
+    result that are within the top 2d genes of the second result. Gene
+    i of the first ranking (0-based) counts from depth max(i+1, r//2+1)
+    on, where r is its rank in the second result, so the overlap at all
+    depths comes from one cumulative count. Genes listed more than once
+    keep their lowest p-value, and missing p-values are ignored.
+
+    Parameters
+    ----------
+    pvals1 : pd.Series
+        p-values of the first result, indexed by gene
+    pvals2 : pd.Series
+        p-values of the second result, indexed by gene
+    max_depth : int
+        largest depth to evaluate
+
+    Returns
+    -------
+    overlap : np.ndarray
+        TopDrop overlap for depths 1 to max_depth
+    """
+    # rank genes by p-value
+    s1 = pvals1.dropna().groupby(level=0).min().sort_values(kind='mergesort')
+    s2 = pvals2.dropna().groupby(level=0).min().sort_values(kind='mergesort')
+    rank2 = pd.Series(np.arange(len(s2)), index=s2.index)
+    rank2 = rank2.reindex(s1.index).values
+
+    # depth at which each gene of the first ranking starts to overlap
+    is_shared = ~np.isnan(rank2)
+    start_depth = np.maximum(np.arange(1, len(s1)+1)[is_shared],
+                             rank2[is_shared].astype(int)//2 + 1)
+    start_depth = start_depth[start_depth <= max_depth]
+    num_intersect = np.bincount(start_depth, minlength=max_depth+1).cumsum()[1:]
+
+    depth = np.arange(1, max_depth+1)
+    num_total = np.minimum(depth, len(s1))
+    overlap = np.zeros(max_depth)
+    is_nonempty = num_total > 0
+    overlap[is_nonempty] = num_intersect[is_nonempty] / num_total[is_nonempty].astype(float)
+    return overlap
@@ -0,0 +1,110 @@
+"""
+File: frame_cache.py
+Description: Persistent on-disk cache of parsed method result files
+"""
+import hashlib
+import os
+import glob
+import pickle
+
+# logging
+import logging
+logger = logging.getLogger(__name__)
+
+# bump whenever the layout of cached data frames changes
+CACHE_VERSION = 4
+
+# file name extension of cached data frames
+ENTRY_SUFFIX = '.pkl'
+
+
+def file_signature(path):
+    """Signature used to decide whether a cached entry is still valid."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime, CACHE_VERSION)
+
+
+class FrameCache(object):
+    """Stores parsed data frames for method result files on disk.
+
+    Entries are keyed by the absolute path of the result file and the
+    kind of parsing that was done ("table" or "residue"). Each entry
+    records the size and modification time of the source file, so an
+    entry is only reused when the source file has not changed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory holding the cached data frames
+    rebuild : bool
+        ignore existing entries and overwrite them with freshly parsed data
+    """
+
+    def __init__(self, cache_dir, rebuild=False):
+        self.cache_dir = cache_dir
+        self.rebuild = rebuild
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _entry_path(self, path, kind):
+        key_str = '{0}\t{1}'.format(os.path.abspath(path), kind)
+        key = hashlib.sha1(key_str.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def get(self, path, kind):
+        """Return the cached data frame for a file, or None if missing/stale."""
+        if self.rebuild:
+            return None
+        entry_path = self._entry_path(path, kind)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            with open(entry_path, 'rb') as handle:
+                entry = pickle.load(handle)
+        except Exception:
+            logger.debug('Unreadable cache entry {0}'.format(entry_path))
+            return None
+        if entry['signature'] != file_signature(path):
+            return None
+        logger.debug('Using cached data for {0}'.format(path))
+        return entry['frame']
+
+    def put(self, path, kind, df):
+        """Save a parsed data frame for a file."""
+        entry_path = self._entry_path(path, kind)
+        entry = {'signature': file_signature(path), 'frame': df}
+
+        # write to a temporary file first so partial writes are never read,
+        # named by process so concurrent writers never share one
+        tmp_path = '{0}.{1}.tmp'.format(entry_path, os.getpid())
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump(entry, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, entry_path)
+
+    def clear(self):
+        """Remove every entry from the cache.
+
+        Only the entry files of this cache are removed, anything else in
+        the cache directory (e.g. the run manifest) is left alone.
+        """
+        logger.info('Clearing cached data frames in {0}'.format(self.cache_dir))
+        for entry_path in glob.glob(os.path.join(self.cache_dir, '*' + ENTRY_SUFFIX)) + \
+                glob.glob(os.path.join(self.cache_dir, '*' + ENTRY_SUFFIX + '.*.tmp')):
+            try:
+                os.remove(entry_path)
+            except OSError:
+                logger.debug('Could not remove cache entry {0}'.format(entry_path))
+
+
+def open_cache(cache_dir, rebuild=False, clear=False):
+    """Open the frame cache requested on the command line.
+
+    Returns None if no cache directory was given, in which case all
+    files are parsed from scratch.
+    """
+    if not cache_dir:
+        return None
+    frame_cache = FrameCache(cache_dir, rebuild=rebuild)
+    if clear:
+        frame_cache.clear()
+    return frame_cache
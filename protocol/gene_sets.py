@@ -0,0 +1,108 @@
+"""
+File: gene_sets.py
+Description: Interned gene symbols and reference driver gene lists
+"""
+import numpy as np
+import pandas as pd
+import threading
+
+
+class GeneIndex(object):
+    """Interning table mapping gene symbols to consecutive integer ids.
+
+    A single table is shared by everything in a run (significant calls,
+    reference gene lists, mutations), so gene sets can be compared as
+    boolean arrays over the same ids instead of as sets of strings.
+    Ids are never reassigned, so arrays built earlier stay valid as new
+    genes are added.
+    """
+
+    def __init__(self, genes=()):
+        self.symbols = []
+        self._ids = {}
+        self._lock = threading.Lock()
+        self.intern(genes)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def intern(self, genes):
+        """Get the id of each gene, adding genes not seen before."""
+        with self._lock:
+            ids = np.empty(len(genes), dtype=np.int64)
+            for i, g in enumerate(genes):
+                gene_id = self._ids.get(g)
+                if gene_id is None:
+                    gene_id = len(self.symbols)
+                    self._ids[g] = gene_id
+                    self.symbols.append(g)
+                ids[i] = gene_id
+        return ids
+
+    def intern_array(self, values):
+        """Get the id of each value in a long array of gene symbols.
+
+        Only the distinct symbols are interned. Missing values get an id
+        of -1.
+        """
+        codes, uniques = pd.factorize(values)
+        uniq_ids = self.intern(list(uniques))
+        ids = np.where(codes >= 0, uniq_ids.take(np.maximum(codes, 0)), -1)
+        return ids
+
+    def lookup(self, genes):
+        """Get the id of each gene, with -1 for genes not in the table."""
+        return np.array([self._ids.get(g, -1) for g in genes], dtype=np.int64)
+
+    def mask(self, genes, size=None):
+        """Boolean array over gene ids marking the given genes.
+
+        Parameters
+        ----------
+        genes : iterable
+            gene symbols
+        size : int or None
+            length of the array, defaults to the number of interned genes.
+            Genes with ids beyond the size are left out.
+        """
+        if size is None:
+            size = len(self)
+        ids = self.lookup(genes)
+        ids = ids[(ids >= 0) & (ids < size)]
+        gene_mask = np.zeros(size, dtype=bool)
+        gene_mask[ids] = True
+        return gene_mask
+
+
+class ReferenceLists(object):
+    """Named reference gene lists (e.g. CGC) stored over a GeneIndex.
+
+    Parameters
+    ----------
+    gene_index : GeneIndex
+        interning table shared with the significant calls
+    """
+
+    def __init__(self, gene_index):
+        self.gene_index = gene_index
+        self.names = []
+        self._ids = []
+
+    def add(self, name, genes):
+        """Add a reference list."""
+        self.names.append(name)
+        self._ids.append(np.unique(self.gene_index.intern(list(genes))))
+
+    def masks(self, size=None):
+        """Boolean (lists, genes) array marking the genes in each list."""
+        if size is None:
+            size = len(self.gene_index)
+        list_masks = np.zeros((len(self.names), size), dtype=bool)
+        for i, ids in enumerate(self._ids):
+            list_masks[i, ids[ids < size]] = True
+        return list_masks
+
+    def union_genes(self):
+        """Set of gene symbols found in any reference list."""
+        all_ids = np.unique(np.concatenate(self._ids)) if self._ids else []
+        return set(self.gene_index.symbols[i] for i in all_ids)
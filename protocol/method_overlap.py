@@ -3,6 +3,7 @@ import os
 from collections import Counter
 import utils
 import config as cfg
+import profiling
 
 # logging
 import logging
@@ -25,71 +26,37 @@ def gene_overlap_count(cts, num_methods):
     return overlap_df
 
 
-def method_overlap_count(signif_genes, config, level='gene'):
+def method_overlap_count(calls, config, level='gene'):
+    """For each non-excluded method, count how many non-excluded methods
+    find each of its significant genes (maximum across cancer types)."""
     meth_names = cfg.fetch_level_names(config, level=level, exclude=True)
-    output_list = []
-    for method in meth_names:
-        # merge method counts for each method individually
-        method_cts = [signif_genes[c][signif_genes[c][method]>0].sum(axis=1)
-                      for c in signif_genes]
-        myresult = pd.concat(method_cts, axis=1)
-        max_method_ct = myresult.max(axis=1)
-
-        # name series according to method
-        max_method_ct.name = method
-
-        # append counts to list
-        output_list.append(max_method_ct)
-
-    # format into dataframe
-    output_df = pd.concat(output_list, axis=1)
-    #output_df = pd.DataFrame(output_list, columns=header_names)
-
+    output_df = calls.subset_methods(meth_names).method_overlap_count()
     return output_df
 
 
-def main(opts):
+def main(opts, store=None):
     logger.info('Running method_overlap sub-command . . .')
-    config = utils.load_config(opts['config'])
+    if store is None:
+        config = utils.load_config(opts['config'])
+        store = utils.open_result_store(opts, config)
+    config = store.config
 
-    all_signif_dict = utils.fetch_significant(opts['input_dir'],
-                                              config,
-                                              level='gene')
-    call_dict = {}
-    gene_methods = cfg.fetch_level_names(config, level='gene')
-    cancer_types = all_signif_dict[all_signif_dict.keys()[0]].keys()
-    for cancer_type in cancer_types:
-        # setup a dataframe with the union of significant genes
-        union_signif = reduce(lambda x, y: x | y,
-                              (set(all_signif_dict[m].get(cancer_type, []))
-                               for m in all_signif_dict))
-        call_df = pd.DataFrame(index=union_signif)
-
-        # add results from each method
-        for meth in gene_methods:
-            call_df[meth] = 0
-            call_df.loc[all_signif_dict[meth].get(cancer_type, []), meth] = 1
-
-        # add results to dictionary
-        call_dict[cancer_type] = call_df
+    calls = store.fetch_call_matrix(level='gene')
+    for cancer_type in calls.cancer_types:
+        # 0/1 calls of each method for genes found by any method
+        call_df = calls.to_frame(cancer_type)
 
         # save dataframe
         tmp_path = os.path.join(opts['output'], cancer_type+'.overlap.txt')
-        call_df.to_csv(tmp_path, sep='\t')
-
-    # eliminate any excluded methods
-    if 'exclude' in config:
-        exclude_methods = config['exclude']
-        cancer_type_list = list(call_dict.keys())
-        for c in cancer_type_list:
-            for meth in exclude_methods:
-                if meth in call_dict[c]:
-                    del call_dict[c][meth]
+        with profiling.stage('writing'):
+            call_df.to_csv(tmp_path, sep='\t')
 
-    # Analyze method counts
-    method_overlap_df = method_overlap_count(call_dict, config, level='gene')
+    # Analyze method counts, ignoring any excluded methods
+    with profiling.stage('overlap'):
+        method_overlap_df = method_overlap_count(calls, config, level='gene')
     tmp_path = os.path.join(opts['output'], 'overlap.txt')
-    method_overlap_df.to_csv(tmp_path, sep='\t')
+    with profiling.stage('writing'):
+        method_overlap_df.to_csv(tmp_path, sep='\t')
     all_cols = method_overlap_df.columns.tolist()
     meth_melt_df = pd.melt(method_overlap_df, value_vars=all_cols).dropna()
 
@@ -107,3 +74,4 @@ def main(opts):
     """
 
     logger.info('Finished method_overlap sub-command.')
+    return calls
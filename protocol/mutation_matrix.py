@@ -0,0 +1,116 @@
+"""
+File: mutation_matrix.py
+Description: Sparse sample by gene matrix of non-silent mutations
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+
+class MutationMatrix(object):
+    """Sparse matrix indicating which genes have a non-silent mutation
+    in each sample.
+
+    Rows are (tumor type, sample) pairs, ordered so the samples of each
+    tumor type form a contiguous block. Samples that only have silent
+    mutations still get an (empty) row, so they count as having zero
+    drivers.
+
+    Parameters
+    ----------
+    mut_df : pd.DataFrame
+        mutations with Hugo_Symbol, Tumor_Sample_Barcode and is_nonsilent
+        columns, as returned by standard_plots.read_maf
+    cancer_type_col : str
+        column containing the tumor type of each mutation
+    """
+
+    def __init__(self, mut_df, cancer_type_col):
+        ttype_codes, tumor_types = pd.factorize(mut_df[cancer_type_col].astype(object))
+        sample_codes, samples = pd.factorize(mut_df['Tumor_Sample_Barcode'])
+        gene_codes, genes = pd.factorize(mut_df['Hugo_Symbol'])
+
+        # drop mutations missing a tumor type or sample
+        is_valid = (ttype_codes >= 0) & (sample_codes >= 0)
+        ttype_codes = ttype_codes[is_valid]
+        sample_codes = sample_codes[is_valid]
+        gene_codes = gene_codes[is_valid]
+        is_nonsilent = mut_df['is_nonsilent'].values[is_valid] == 1
+
+        # one row per (tumor type, sample) pair, grouped by tumor type
+        pair_codes = ttype_codes.astype(np.int64) * len(samples) + sample_codes
+        uniq_pairs, row_codes = np.unique(pair_codes, return_inverse=True)
+        row_ttypes = uniq_pairs // len(samples)
+        self.row_samples = np.asarray(samples).take(uniq_pairs % len(samples))
+        self.tumor_types = list(tumor_types)
+        self.genes = genes
+        self.gene_ix = pd.Series(np.arange(len(genes)), index=genes)
+
+        # start/end row of each tumor type's block of samples
+        block_ends = np.searchsorted(row_ttypes, np.arange(len(tumor_types)), side='right')
+        block_starts = np.concatenate([[0], block_ends[:-1]])
+        self.blocks = {t: (block_starts[i], block_ends[i])
+                       for i, t in enumerate(self.tumor_types)
+                       if block_ends[i] > block_starts[i]}
+
+        # binary matrix of non-silent mutations
+        keep = is_nonsilent & (gene_codes >= 0)
+        data = np.ones(keep.sum(), dtype=np.int32)
+        mat = sparse.coo_matrix((data, (row_codes[keep], gene_codes[keep])),
+                                shape=(len(uniq_pairs), len(genes))).tocsr()
+        mat.sum_duplicates()
+        mat.data[:] = 1
+        self.matrix = mat
+
+    def drivers_per_sample(self, signif_dict):
+        """Count the number of mutated driver genes in each sample.
+
+        Counts for all methods and tumor types come from a single sparse
+        matrix product with a gene by (method, tumor type) indicator matrix.
+
+        Parameters
+        ----------
+        signif_dict : dict
+            significant genes as {method: {tumor type: gene list}}
+
+        Returns
+        -------
+        drivers_dict : dict
+            {method: {tumor type: pd.Series}}, where each series holds the
+            number of mutated drivers for every sample of the tumor type.
+            Tumor types without mutations or significant genes are skipped.
+        """
+        # build the gene indicator matrix
+        columns = []
+        ind_rows, ind_cols = [], []
+        for method in signif_dict:
+            for ttype in signif_dict[method]:
+                if ttype not in self.blocks: continue
+                gene_codes = self.gene_ix.reindex(signif_dict[method][ttype]).dropna()
+                gene_codes = np.unique(gene_codes.values.astype(int))
+                ind_rows.append(gene_codes)
+                ind_cols.append(np.repeat(len(columns), len(gene_codes)))
+                columns.append((method, ttype))
+        drivers_dict = {m: {} for m in signif_dict}
+        if not columns:
+            return drivers_dict
+        ind_rows = np.concatenate(ind_rows)
+        ind_cols = np.concatenate(ind_cols)
+        indicator = sparse.csc_matrix((np.ones(len(ind_rows), dtype=np.int32),
+                                       (ind_rows, ind_cols)),
+                                      shape=(len(self.genes), len(columns)))
+
+        # count drivers for every sample/column pair at once
+        counts = self.matrix.dot(indicator).tocsc()
+
+        # pull out the samples of the matching tumor type for each column
+        for j, (method, ttype) in enumerate(columns):
+            start, end = self.blocks[ttype]
+            col_rows = counts.indices[counts.indptr[j]:counts.indptr[j+1]]
+            col_vals = counts.data[counts.indptr[j]:counts.indptr[j+1]]
+            in_block = (col_rows >= start) & (col_rows < end)
+            num_drivers = np.zeros(end-start)
+            num_drivers[col_rows[in_block]-start] = col_vals[in_block]
+            drivers_dict[method][ttype] = pd.Series(num_drivers,
+                                                    index=self.row_samples[start:end])
+        return drivers_dict
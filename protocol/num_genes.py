@@ -1,5 +1,6 @@
 import pandas as pd
 import utils
+import profiling
 import os
 import csv
 
@@ -22,25 +23,23 @@ def iqr_outlier_cutoff(myseries, multiplier=1.5):
 
 
 
-def main(opts):
+def main(opts, store=None):
     logger.info('Running num_signif sub-command . . .')
-    config = utils.load_config(opts['config'])
+    if store is None:
+        config = utils.load_config(opts['config'])
+        store = utils.open_result_store(opts, config)
+    config = store.config
 
-    # get the significant genes for each method
-    signif_dict = utils.fetch_significant(opts['input_dir'],
-                                          config,
-                                          level='gene')
-    num_methods = len(signif_dict)
+    # get the number of significant genes for each method
+    calls = store.fetch_call_matrix(level='gene')
+    all_num_signif_df = calls.num_significant().drop('PANCAN', errors='ignore')
 
     # count the number of significant for each method
     num_signif_list = []
     outlier_dict = {}
-    for m in signif_dict:
+    for m in calls.methods:
         # calculate the total number of significant
-        num_signif = {c: len(signif_dict[m][c])
-                      for c in signif_dict[m]
-                      if c != 'PANCAN'}
-        num_series = pd.Series(num_signif)
+        num_series = all_num_signif_df[m].dropna().astype(int)
         num_series.name = m
 
         # figure out outliers
@@ -55,16 +54,18 @@ def main(opts):
 
     # save result
     if not os.path.exists(opts['output']): os.makedirs(opts['output'])
-    # save number of significant
-    out_path = os.path.join(opts['output'], 'num_significant.txt')
-    pd.concat(num_signif_list, axis=1).to_csv(out_path, sep='\t')
-    # save outliers
-    out_path = os.path.join(opts['output'], 'outliers.txt')
-    with open(out_path, 'w') as handle:
-        mywriter = csv.writer(handle, delimiter='\t', lineterminator='\n')
-        for meth in outlier_dict:
-            tmp_line = [meth, ','.join(outlier_dict[meth])]
-            mywriter.writerow(tmp_line)
+    with profiling.stage('writing'):
+        # save number of significant
+        out_path = os.path.join(opts['output'], 'num_significant.txt')
+        num_signif_df = pd.concat(num_signif_list, axis=1)
+        num_signif_df.to_csv(out_path, sep='\t')
+        # save outliers
+        out_path = os.path.join(opts['output'], 'outliers.txt')
+        with open(out_path, 'w') as handle:
+            mywriter = csv.writer(handle, delimiter='\t', lineterminator='\n')
+            for meth in outlier_dict:
+                tmp_line = [meth, ','.join(outlier_dict[meth])]
+                mywriter.writerow(tmp_line)
 
     logger.info('Finished num_signif sub-command.')
-    return num_series
+    return num_signif_df, outlier_dict
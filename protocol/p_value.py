@@ -1,36 +1,53 @@
-import numpy as np
 import pandas as pd
-import eval_stats
 import utils
 import config as cfg
 import os
 import cgc_overlap
+import profiling
+import run_manifest
+import pvalue_store
 
 # logging
 import logging
 logger = logging.getLogger(__name__)
 
-def calculate_mlfc(df, meth_name, config):
-    pval_cols = ['pvalue']
+def filtered_mlfc(store, path_dict, blacklist):
+    """Calculate MLFC scores of many result files, leaving out the genes
+    in the blacklist.
 
-    # calculate the mlfc scores for each pvalue column
-    mlfc_score_list = []
-    for pval_col in pval_cols:
-        #pvals = df[pval_col].dropna().copy()
-        pvals = df[pval_col].fillna(1.0).copy()
-        tmp_score = eval_stats.mean_log_fold_change(pvals)
-        mlfc_score_list.append(tmp_score)
+    The p-values are read from a memory-mapped p-value store, see
+    pvalue_store.open_pvalue_store, so only a chunk of p-values is in
+    memory at a time.
 
-    # calculate the mean score, if multiple values
-    mean_mlfc = np.mean(mlfc_score_list)
+    Parameters
+    ----------
+    store : utils.ResultStore
+        result store whose config names the p-value columns
+    path_dict : dict
+        result file of each (method, cancer type)
+    blacklist : set
+        genes to leave out
 
-    return mean_mlfc
+    Returns
+    -------
+    mlfc_dict : dict
+        MLFC score for each key of path_dict
+    """
+    pval_store = pvalue_store.open_pvalue_store(store, path_dict)
+    try:
+        with profiling.stage('mlfc'):
+            return pval_store.mlfc(blacklist, keys=list(path_dict))
+    finally:
+        pval_store.close()
 
 
-def main(opts):
+def main(opts, store=None):
     logger.info('Running p-value sub-command . . .')
     # load config
-    config = utils.load_config(opts['config'])
+    if store is None:
+        config = utils.load_config(opts['config'])
+        store = utils.open_result_store(opts, config)
+    config = store.config
 
     # Read in driver lists
     cgc = utils.process_cgc(opts['cgc'])
@@ -39,18 +56,16 @@ def main(opts):
     tamborero = cgc_overlap.read_custom_list(opts['high_confidence_list'])
     blacklist = set(cgc) | set(landscapes) | set(kandoth) | set(tamborero)
 
-    # iterate over methods
+    # compute MLFC scores for all methods and cancer types at once, reusing
+    # the scores of unchanged result files if there is a run manifest
     gene_methods = cfg.fetch_level_names(config, level='gene')
+    blacklist_digest = run_manifest.sha1_json(sorted(blacklist))
+    mlfc_scores = store.memoize_cells('mlfc', gene_methods,
+                                      lambda path_dict: filtered_mlfc(store, path_dict, blacklist),
+                                      extra=blacklist_digest, load=False)
     mlfc_list = []
     for method_name in gene_methods:
-        # get full data for each method
-        full_data = utils.fetch_filtered_dataframes(opts['input_dir'],
-                                                    blacklist,
-                                                    method_name)
-
-        # compute MLFC scores
-        mlfc_result = {m: calculate_mlfc(full_data[m], m, config)
-                       for m in full_data}
+        mlfc_result = {k[1]: mlfc_scores[k] for k in mlfc_scores if k[0] == method_name}
         mlfc_series = pd.Series(mlfc_result)
         mlfc_series.name = method_name
         mlfc_list.append(mlfc_series)
@@ -60,7 +75,8 @@ def main(opts):
 
     # save output
     mlfc_path = os.path.join(opts['output'], 'mlfc_scores.txt')
-    mlfc_df.to_csv(mlfc_path, sep='\t')
+    with profiling.stage('writing'):
+        mlfc_df.to_csv(mlfc_path, sep='\t')
 
     #if opts['plot']:
         #import plot_data
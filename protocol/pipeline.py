@@ -0,0 +1,110 @@
+"""
+File: pipeline.py
+Description: Runs the consensus workflow as a dependency graph of stages
+"""
+from multiprocessing.pool import ThreadPool
+import utils
+
+# logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def load_stage(opts, store, results):
+    """Read the significant genes of every method into the shared store."""
+    return store.fetch_significant(level='gene')
+
+
+def num_signif_stage(opts, store, results):
+    import num_genes
+    return num_genes.main(opts, store=store)
+
+
+def list_overlap_stage(opts, store, results):
+    import cgc_overlap
+    return cgc_overlap.main(opts, store=store)
+
+
+def pvalue_stage(opts, store, results):
+    import p_value
+    return p_value.main(opts, store=store)
+
+
+def method_overlap_stage(opts, store, results):
+    import method_overlap
+    return method_overlap.main(opts, store=store)
+
+
+def consensus_stage(opts, store, results):
+    import consensus
+    num_signif_df, outlier_dict = results['num_signif']
+    return consensus.main(opts,
+                          mlfc_df=results['pvalue'],
+                          outliers=outlier_dict,
+                          driver_ovlp_df=results['list_overlap'],
+                          calls=results['method_overlap'])
+
+
+# each stage is (name, names of the stages it depends on, function)
+CONSENSUS_STAGES = [
+    ('load', [], load_stage),
+    ('num_signif', ['load'], num_signif_stage),
+    ('list_overlap', ['load'], list_overlap_stage),
+    ('pvalue', ['load'], pvalue_stage),
+    ('method_overlap', ['load'], method_overlap_stage),
+    ('consensus', ['num_signif', 'list_overlap', 'pvalue', 'method_overlap'],
+     consensus_stage),
+]
+
+
+def run_stages(stages, opts, store):
+    """Run stages in dependency order.
+
+    Stages whose dependencies are all finished are run concurrently in
+    separate threads. Each stage gets the results of the earlier stages in
+    memory, so no stage has to read the output files of another stage.
+
+    Parameters
+    ----------
+    stages : list
+        list of (name, dependency names, function) tuples
+    opts : dict
+        command line options
+    store : utils.ResultStore
+        result store shared by all stages
+
+    Returns
+    -------
+    results : dict
+        return value of each stage, keyed by stage name
+    """
+    results = {}
+    pending = list(stages)
+    while pending:
+        ready = [s for s in pending if all(d in results for d in s[1])]
+        if not ready:
+            bad_names = ', '.join(s[0] for s in pending)
+            raise ValueError('Unresolvable stage dependencies: {0}'.format(bad_names))
+
+        logger.info('Running stage(s): {0}'.format(', '.join(s[0] for s in ready)))
+        pool = ThreadPool(len(ready))
+        try:
+            async_results = [(name, pool.apply_async(func, (opts, store, results)))
+                             for name, deps, func in ready]
+            stage_output = [(name, r.get()) for name, r in async_results]
+        finally:
+            pool.close()
+            pool.join()
+        results.update(stage_output)
+        pending = [s for s in pending if s not in ready]
+    return results
+
+
+def main(opts, store=None):
+    logger.info('Running run_all sub-command . . .')
+    if store is None:
+        config = utils.load_config(opts['config'])
+        store = utils.open_result_store(opts, config)
+    results = run_stages(CONSENSUS_STAGES, opts, store)
+    logger.info('Finished run_all sub-command.')
+    return results
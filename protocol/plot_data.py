@@ -1,13 +1,13 @@
 import numpy as np
-import pandas as pd
 import matplotlib as mpl
 mpl.use('agg')
 mpl.rcParams['pdf.fonttype'] = 42
 import matplotlib.pyplot as plt
 import seaborn as sns
+import eval_stats
 
 
-def multi_qqplot(data, max_pval=1.0):
+def multi_qqplot(data, max_pval=1.0, max_points=eval_stats.QQ_MAX_POINTS):
     with sns.axes_style('ticks'), sns.plotting_context('paper', font_scale=2.5):
         # change dpi
         import matplotlib as mpl
@@ -16,7 +16,7 @@ def multi_qqplot(data, max_pval=1.0):
         # make qq plot for each method
         g = sns.FacetGrid(data, col="method", col_wrap=3,
                           sharey=False, aspect=1.5)
-        g.map(qqplot, "p-value")
+        g.map(qqplot, "p-value", max_points=max_points)
         plt.tight_layout()
 
         #set_axes_label(g.fig, 'Theoretical ($log_{10}(p)$)', 'Ovserved ($log_{10}(p)$)', ylab_xoffset=-0.02, xlab_yoffset=-0.02)
@@ -56,11 +56,19 @@ def qqplot(data,
            ax=None,
            log=False, title=None,
            use_xlabel=True, use_ylabel=True,
+           max_points=None, expected=None,
            **kwargs):
-    """qq-plot with uniform distribution"""
-    tmp = data.copy()
-    tmp.sort()
-    dist_quant = np.arange(1, len(tmp)+1)/float(len(tmp)+1)
+    """qq-plot with uniform distribution
+
+    If max_points is given, large sets of p-values are thinned with
+    eval_stats.thin_qq_points. Points computed beforehand can be
+    plotted by passing the sorted observed p-values as data and their
+    expected p-values.
+    """
+    if expected is None:
+        dist_quant, tmp = eval_stats.thin_qq_points(data, log=log, max_points=max_points)
+    else:
+        dist_quant, tmp = np.asarray(expected), np.asarray(data)
     if log:
         log_quant = -np.log10(dist_quant)
         if ax is None:
@@ -96,10 +104,15 @@ def qqplot(data,
     return ax
 
 
-def single_method_qqplot(pval_series, filepath):
-    """Perform a qq plot for a single method."""
+def single_method_qqplot(qq_df, filepath):
+    """Perform a qq plot for a single method.
+
+    qq_df has the expected and observed p-values of the points to plot,
+    see standard_plots.qq_table.
+    """
     with sns.axes_style('ticks'), sns.plotting_context('paper', font_scale=1.5):
-        qqplot(pval_series, log=True)
+        qqplot(qq_df['observed p-value'], log=True,
+               expected=qq_df['expected p-value'])
         ax = plt.gca()
         ax.set_ylim((0, 7))
         plt.gcf().set_size_inches((3.5,2.5))
@@ -131,14 +144,13 @@ def single_method_overlap(s, filepath):
         plt.close()
 
 
-def single_method_driver_per_sample(driver_per_sample, filepath):
+def single_method_driver_per_sample(ttype_df, custom_order, filepath):
+    """Plot the mean number of drivers per sample of each cancer type.
+
+    ttype_df and custom_order are made by
+    standard_plots.driver_per_sample_table.
+    """
     with sns.axes_style('ticks'), sns.plotting_context('paper', font_scale=1.0):
-        driver_list = [pd.DataFrame({'tumor type': ttype, 'type': 'All Driver', '# Per Sample': count})
-                    for ttype, count in driver_per_sample.iteritems()]
-        ttype_df = pd.concat(driver_list)
-        ttype_df['# Per Sample'] = ttype_df['# Per Sample'].astype(int)
-        mean_per_sample = ttype_df.groupby('tumor type')['# Per Sample'].mean()
-        custom_order = mean_per_sample.sort_values().index
         sns.barplot('tumor type', '# Per Sample', data=ttype_df,
                     order=custom_order, color=sns.color_palette()[0], ci=95)
         plt.ylabel('Avg. # mutated drivers per sample')
@@ -149,7 +161,6 @@ def single_method_driver_per_sample(driver_per_sample, filepath):
         plt.tight_layout()
         plt.savefig(filepath)
         plt.close()
-    return custom_order
 
 
 def single_method_num_drivers_per_type(gene_ttype_ct, custom_order, filepath):
@@ -289,7 +300,7 @@ def consistency(consis_df, depth, path):
                                order=method_order, color=sns.xkcd_rgb["grey"])
             myax.errorbar(np.arange(len(method_order)), consis_df[mean_col].ix[method_order],
                           yerr=consis_df[sem_col].ix[method_order],
-                          fmt=None, ecolor=sns.xkcd_rgb["black"],
+                          fmt='none', ecolor=sns.xkcd_rgb["black"],
                           elinewidth=2, capsize=9, capthick=2)
             myax.set_xticklabels(method_order, rotation=45, ha='right')
             myax.yaxis.set_ticks_position('left')
@@ -0,0 +1,351 @@
+"""
+File: profiling.py
+Description: Per-stage timing, memory and I/O metrics for the --profile option
+"""
+import threading
+import time
+import json
+import sys
+import os
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+# logging
+import logging
+logger = logging.getLogger(__name__)
+
+METRIC_NAMES = ['calls', 'wall_time', 'cpu_time', 'child_cpu_time',
+                'rss_delta_mb', 'process_peak_rss_mb',
+                'files_read', 'bytes_read', 'rows_parsed']
+
+# metrics that keep the largest value over all entries into a stage,
+# rather than the sum
+MAX_METRICS = ['rss_delta_mb', 'process_peak_rss_mb']
+
+# the active profiler, None unless --profile was given
+_profiler = None
+_local = threading.local()
+
+
+# clock_gettime clock of the CPU time of the calling thread on linux
+CLOCK_THREAD_CPUTIME_ID = 3
+
+# function returning the CPU time of the calling thread, set up on first use
+_thread_cpu_time = None
+
+
+def _thread_cpu_timer():
+    """Get a function returning the CPU time of the calling thread, or
+    None if the platform can not measure it.
+
+    Uses clock_gettime(CLOCK_THREAD_CPUTIME_ID), which python 2 does not
+    expose, so there it is called from the C library through ctypes.
+    """
+    if hasattr(time, 'clock_gettime') and hasattr(time, 'CLOCK_THREAD_CPUTIME_ID'):
+        return lambda: time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+
+    class Timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+
+    def thread_cpu_time():
+        ts = Timespec()
+        if clock_gettime(CLOCK_THREAD_CPUTIME_ID, ctypes.byref(ts)) != 0:
+            raise OSError('clock_gettime failed')
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    try:
+        thread_cpu_time()
+    except OSError:
+        return None
+    return thread_cpu_time
+
+
+def _process_cpu_time():
+    """CPU time of the whole process, all threads included."""
+    if resource is None:
+        return time.clock() if hasattr(time, 'clock') else time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _cpu_time():
+    """CPU time of the calling thread if available, else of the process."""
+    global _thread_cpu_time
+    if _thread_cpu_time is None:
+        _thread_cpu_time = _thread_cpu_timer() or _process_cpu_time
+    return _thread_cpu_time()
+
+
+def _children_cpu_time():
+    """CPU time of the child processes that have finished and been waited
+    for, e.g. the workers of a joined process pool."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _current_rss():
+    """Current resident memory of the process, in MB, or None if it can
+    not be read (only linux has /proc/self/statm)."""
+    try:
+        with open('/proc/self/statm') as handle:
+            resident_pages = int(handle.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+
+
+def _peak_rss():
+    """Peak resident memory of the process so far, in MB.
+
+    This is a high-water mark for the whole process, so it is the same
+    for every stage run after the peak.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    # ru_maxrss is in bytes on mac, but kilobytes on linux
+    if sys.platform == 'darwin':
+        maxrss /= 1024.0
+    return maxrss
+
+
+def _empty_metrics():
+    metrics = {k: 0 for k in METRIC_NAMES}
+    for k in MAX_METRICS:
+        metrics[k] = None
+    return metrics
+
+
+class Profiler(object):
+    """Accumulates metrics for named stages (loading, thresholding, ...).
+
+    A stage may be entered many times, e.g. once per result file, and
+    its metrics are summed over all entries, except for the memory
+    metrics, which keep the largest value. Reads are counted against
+    the innermost stage active in the reading thread. CPU time of a stage
+    is that of the thread running it on linux, so stages running
+    concurrently in threads (e.g. in run_all) are measured separately.
+    Elsewhere it is the CPU time of the whole process, which includes
+    every stage running at the same time. CPU time of process pools is
+    only counted for code run inside child_cpu.
+
+    rss_delta_mb is the change in resident memory from entering to
+    leaving the stage (linux only), and process_peak_rss_mb is the peak
+    resident memory of the whole process when the stage was left.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._start_wall = time.time()
+        self._start_cpu = _process_cpu_time()
+        self._start_children_cpu = _children_cpu_time()
+
+    def add(self, stage_name, **values):
+        """Add metric values to a stage."""
+        with self._lock:
+            metrics = self.stages.setdefault(stage_name, _empty_metrics())
+            for k, v in values.items():
+                if k in MAX_METRICS:
+                    if v is not None:
+                        metrics[k] = v if metrics[k] is None else max(v, metrics[k])
+                else:
+                    metrics[k] += v
+
+    def summary(self):
+        """Get the metrics of all stages and of the whole command."""
+        child_cpu_time = _children_cpu_time() - self._start_children_cpu
+        total = {'wall_time': time.time() - self._start_wall,
+                 'cpu_time': _process_cpu_time() - self._start_cpu + child_cpu_time,
+                 'child_cpu_time': child_cpu_time,
+                 'process_peak_rss_mb': _peak_rss()}
+        for k in ['files_read', 'bytes_read', 'rows_parsed']:
+            total[k] = sum(self.stages[s][k] for s in self.stages)
+        return {'command': self.command,
+                'total': total,
+                'stages': self.stages}
+
+    def save(self, path):
+        """Write the metrics to a JSON file."""
+        with open(path, 'w') as handle:
+            json.dump(self.summary(), handle, indent=2, sort_keys=True)
+
+
+class _Stage(object):
+    """Context manager timing one entry into a stage."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self.name)
+        self.start_wall = time.time()
+        self.start_cpu = _cpu_time()
+        self.start_rss = _current_rss()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.stack.pop()
+        end_rss = _current_rss()
+        rss_delta = end_rss - self.start_rss if end_rss is not None and self.start_rss is not None else None
+        _profiler.add(self.name,
+                      calls=1,
+                      wall_time=time.time() - self.start_wall,
+                      cpu_time=_cpu_time() - self.start_cpu,
+                      rss_delta_mb=rss_delta,
+                      process_peak_rss_mb=_peak_rss())
+        return False
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+def enable(command):
+    """Start profiling a sub-command."""
+    global _profiler
+    _profiler = Profiler(command)
+    return _profiler
+
+
+def disable():
+    """Stop profiling and return the profiler."""
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    return profiler
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def stage(name):
+    """Get a context manager recording metrics for a stage.
+
+    Does nothing unless profiling is enabled.
+    """
+    if _profiler is None:
+        return _NullStage()
+    return _Stage(name)
+
+
+def record_read(path=None, rows=0, num_files=1, num_bytes=None):
+    """Count a file read by the innermost active stage of this thread."""
+    if _profiler is None and getattr(_local, 'collected', None) is None:
+        return
+    if num_bytes is None:
+        num_bytes = os.path.getsize(path) if path is not None else 0
+    values = {'files_read': num_files, 'bytes_read': num_bytes,
+              'rows_parsed': rows}
+
+    collected = getattr(_local, 'collected', None)
+    if collected is not None:
+        # reading in a worker process, hand the counts back to the parent
+        for k in values:
+            collected[k] += values[k]
+    else:
+        stack = getattr(_local, 'stack', None)
+        _profiler.add(stack[-1] if stack else 'other', **values)
+
+
+class collect_reads(object):
+    """Context manager gathering the reads of a worker process, so they
+    can be returned and passed to add_reads in the parent process."""
+
+    def __enter__(self):
+        _local.collected = {'files_read': 0, 'bytes_read': 0, 'rows_parsed': 0}
+        return _local.collected
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.collected = None
+        return False
+
+
+class child_cpu(object):
+    """Context manager adding the CPU time of child processes that finish
+    inside it, e.g. the workers of a process pool, to a stage, by default
+    the innermost stage of this thread.
+
+    The pool has to be joined inside the context. Child CPU time is only
+    known for the whole process, so pools finishing at the same time in
+    other threads are counted too.
+    """
+
+    def __init__(self, stage_name=None):
+        self.stage_name = stage_name
+
+    def __enter__(self):
+        self.start = _children_cpu_time() if _profiler is not None else None
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if _profiler is not None and self.start is not None:
+            delta = _children_cpu_time() - self.start
+            stage_name = self.stage_name
+            if stage_name is None:
+                stack = getattr(_local, 'stack', None)
+                stage_name = stack[-1] if stack else 'other'
+            _profiler.add(stage_name, cpu_time=delta, child_cpu_time=delta)
+        return False
+
+
+def add_reads(collected, stage_name='loading'):
+    """Add the reads gathered in a worker process to a stage."""
+    if _profiler is None or not collected:
+        return
+    _profiler.add(stage_name, **collected)
+
+
+def run_profiled(func, opts, command):
+    """Run a sub-command, profiling it if requested in the options.
+
+    With --profile, per-stage metrics are written to <command>.profile.json
+    in the output directory. With --cprofile, a cProfile dump of the whole
+    sub-command is also written to <command>.prof.
+    """
+    if not (opts.get('profile') or opts.get('cprofile')):
+        return func(opts)
+
+    profiler = enable(command)
+    cprof = None
+    if opts.get('cprofile'):
+        import cProfile
+        cprof = cProfile.Profile()
+        cprof.enable()
+    try:
+        return func(opts)
+    finally:
+        if cprof is not None:
+            cprof.disable()
+            prof_path = os.path.join(opts['output'], command+'.prof')
+            cprof.dump_stats(prof_path)
+            logger.info('Wrote cProfile output to {0}'.format(prof_path))
+        disable()
+        json_path = os.path.join(opts['output'], command+'.profile.json')
+        profiler.save(json_path)
+        logger.info('Wrote profile to {0}'.format(json_path))
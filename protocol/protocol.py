@@ -1,6 +1,6 @@
 import sys
 import argparse
-import utils
+import profiling
 import os
 import logging
 
@@ -46,11 +46,22 @@ def parse_arguments():
     parser_consensus = subparsers.add_parser('consensus',
                                              help=help_info,
                                              description='Perform driver gene consensus analysis')
+    help_info = ('Run num_signif, list_overlap, pvalue, method_overlap and '
+                 'consensus in a single process')
+    parser_all = subparsers.add_parser('run_all',
+                                       help=help_info,
+                                       description=help_info)
+    help_info = ('Evaluate the consistency of methods between results on '
+                 'split or replicate data')
+    parser_consis = subparsers.add_parser('consistency',
+                                          help=help_info,
+                                          description=help_info)
 
     # program arguments
     for i, parser in enumerate([parser_cgc, parser_ovlp,
                                 parser_pval, parser_signif,
-                                parser_consensus]):
+                                parser_consensus, parser_all,
+                                parser_consis]):
 
         # group of parameters
         major_parser = parser.add_argument_group(title='Major options')
@@ -61,7 +72,34 @@ def parse_arguments():
             major_parser.add_argument('-i', '--input-dir',
                                     type=str, default=None,
                                     help=help_str)
+            help_str = ('Directory for caching parsed method result files. '
+                        'Cached files are reused if the result file is unchanged (Default: no cache)')
+            advance_parser.add_argument('--cache-dir',
+                                        type=str, default=None,
+                                        help=help_str)
+            help_str = 'Re-parse all result files and overwrite the cache (Default: False)'
+            advance_parser.add_argument('--rebuild-cache',
+                                        action='store_true', default=False,
+                                        help=help_str)
+            help_str = 'Remove all cached files before running (Default: False)'
+            advance_parser.add_argument('--clear-cache',
+                                        action='store_true', default=False,
+                                        help=help_str)
+            help_str = 'Number of processes used to read result files (Default: 1)'
+            advance_parser.add_argument('-j', '--jobs',
+                                        type=int, default=1,
+                                        help=help_str)
 
+        help_str = ('Record the time, memory and I/O of each stage in '
+                    '<sub-command>.profile.json in the output directory (Default: False)')
+        advance_parser.add_argument('--profile',
+                                    action='store_true', default=False,
+                                    help=help_str)
+        help_str = ('Also write a cProfile dump of the sub-command to '
+                    '<sub-command>.prof in the output directory (Default: False)')
+        advance_parser.add_argument('--cprofile',
+                                    action='store_true', default=False,
+                                    help=help_str)
         help_str = 'Configuration file (YAML format)'
         major_parser.add_argument('-config', '--config',
                                   type=str, default=None,
@@ -71,7 +109,7 @@ def parse_arguments():
                                   type=str, default=None,
                                   help=help_str)
 
-        if i == 0 or i == 2:
+        if i == 0 or i == 2 or i == 5:
             #list_parser = major_parser.add_mutually_exclusive_group(required=True)
             help_str = 'Path to Cancer Gene Census file'
             major_parser.add_argument('-c', '--cgc',
@@ -97,6 +135,24 @@ def parse_arguments():
             advance_parser.add_argument('-p', '--plot',
                                         action='store_true', default=False,
                                         help=help_str)
+            if i == 0:
+                help_str = ('Also count significant genes and driver list overlap '
+                            'at this many thresholds for every method and cancer type, '
+                            'written to threshold_sweep.txt (Default: no sweep)')
+                advance_parser.add_argument('--threshold-sweep',
+                                            type=int, default=None,
+                                            help=help_str)
+            if i == 0 or i == 5:
+                help_str = ('Number of random gene sets drawn for permutation p-values '
+                            'of the driver list enrichment (Default: 0, exact '
+                            'hypergeometric p-values only)')
+                advance_parser.add_argument('--permutations',
+                                            type=int, default=0,
+                                            help=help_str)
+                help_str = 'Random seed for the permutations (Default: 101)'
+                advance_parser.add_argument('--seed',
+                                            type=int, default=101,
+                                            help=help_str)
         elif i == 1:
             help_str = 'Generate plots examining evaluation (Default: False)'
             advance_parser.add_argument('-p', '--plot',
@@ -129,8 +185,33 @@ def parse_arguments():
                                       type=str, required=True,
                                       help=help_str)
 
+        if i == 5:
+            help_str = 'Flag indicating not to weight methods'
+            major_parser.add_argument('--not-weighted',
+                                      action='store_true', default=False,
+                                      help=help_str)
+        elif i == 6:
+            help_str = ('directory containing results from methods on the other '
+                        'half (or replicate) of the data')
+            major_parser.add_argument('-s', '--second-input-dir',
+                                      type=str, required=True,
+                                      help=help_str)
+            help_str = ('TopDrop overlap is computed for every depth up to this '
+                        'number of genes, and summarized at it (Default: 100)')
+            major_parser.add_argument('-d', '--depth',
+                                      type=int, default=100,
+                                      help=help_str)
+            help_str = 'Generate plots examining evaluation (Default: False)'
+            advance_parser.add_argument('-p', '--plot',
+                                        action='store_true', default=False,
+                                        help=help_str)
+
     args = parent_parser.parse_args()
 
+    # utils pulls in pandas, so only import it once the arguments are
+    # valid and --help was not asked for
+    import utils
+
     # handle logging
     if args.log_level or args.log:
         if args.log:
@@ -157,6 +238,10 @@ def main(opts):
     if not os.path.exists(opts['output']):
         os.makedirs(opts['output'])
 
+    profiling.run_profiled(run_command, opts, opts['kind'])
+
+
+def run_command(opts):
     # run commands
     if opts['kind'] == 'list_overlap':
         import cgc_overlap
@@ -173,6 +258,12 @@ def main(opts):
     elif opts['kind'] == 'consensus':
         import consensus
         consensus.main(opts)
+    elif opts['kind'] == 'run_all':
+        import pipeline
+        pipeline.main(opts)
+    elif opts['kind'] == 'consistency':
+        import consistency
+        consistency.main(opts)
 
 
 def cli_main():
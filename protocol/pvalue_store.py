@@ -0,0 +1,360 @@
+"""
+File: pvalue_store.py
+Description: Memory-mapped, sorted p-values of result files, for out-of-core analyses
+"""
+import numpy as np
+import pandas as pd
+import tempfile
+import hashlib
+import shutil
+import json
+import os
+import utils
+import gene_sets
+import eval_stats
+import frame_cache
+import profiling
+
+# logging
+import logging
+logger = logging.getLogger(__name__)
+
+# bump whenever the layout of the store changes
+STORE_VERSION = 2
+PVALUE_DTYPE = np.float64
+GENE_CODE_DTYPE = np.int32
+
+# sub-directory of the cache directory holding the p-value store
+STORE_DIR_NAME = 'pvalues'
+
+# p-values per chunk when scanning the p-values of a cell
+SCAN_ROWS = 1000000
+
+# p-values scored together by the batched MLFC engine, the p-values of
+# a single cell are always scored in one batch
+MLFC_BATCH_ROWS = 2000000
+
+
+def read_pvalue_chunks(path, gene_col='gene', pval_col='pvalue'):
+    """Read the genes and p-values of a result file in chunks.
+
+    Yields
+    ------
+    genes : np.ndarray
+        gene names of the chunk
+    pvals : pd.Series
+        p-values of the chunk, as read
+    """
+    missing_cols = [c for c in [gene_col, pval_col] if c not in utils.read_header(path)]
+    if missing_cols:
+        raise ValueError('Columns not found in {0}: {1}. Please specify '
+                         'the correct name in the config file.'.format(path, ', '.join(missing_cols)))
+    num_rows = 0
+    with utils.open_input(path) as handle:
+        for chunk in pd.read_table(handle, usecols=[gene_col, pval_col],
+                                   dtype={gene_col: str}, chunksize=utils.CHUNK_ROWS):
+            num_rows += len(chunk)
+            yield chunk[gene_col].values, chunk[pval_col]
+    profiling.record_read(path, rows=num_rows)
+
+
+def entry_dir(store_dir, path, gene_col='gene', pval_col='pvalue'):
+    """Directory of the store entry of a result file, keyed by its absolute
+    path and the columns read from it."""
+    key_str = '{0}\t{1}\t{2}'.format(os.path.abspath(path), gene_col, pval_col)
+    return os.path.join(store_dir, hashlib.sha1(key_str.encode('utf-8')).hexdigest())
+
+
+def write_pvalue_file(out_dir, signature, chunks):
+    """Write the p-values of a result file to a store entry.
+
+    The p-values are sorted once here, missing p-values last, with the
+    gene codes kept in the same order. The entry is written to a
+    temporary directory and then renamed, so a partly written entry is
+    never read.
+
+    Parameters
+    ----------
+    out_dir : str
+        directory of the entry, see entry_dir
+    signature : tuple
+        signature of the result file, see frame_cache.file_signature
+    chunks : iterable
+        (gene names, p-values) of the result file, see read_pvalue_chunks
+
+    Returns
+    -------
+    pval_file : PValueFile
+        the opened entry
+    """
+    gene_index = gene_sets.GeneIndex()
+    pval_list, code_list = [], []
+    reports_pvalues = None
+    for genes, pvals in chunks:
+        if reports_pvalues is None and len(pvals):
+            # methods without p-values have '.' in the p-value column
+            reports_pvalues = pvals.iloc[0] != '.'
+        pval_list.append(pd.to_numeric(pvals, errors='coerce').values.astype(PVALUE_DTYPE))
+        code_list.append(gene_index.intern_array(genes).astype(GENE_CODE_DTYPE))
+    pvals = np.concatenate(pval_list) if pval_list else np.zeros(0, dtype=PVALUE_DTYPE)
+    gene_codes = np.concatenate(code_list) if code_list else np.zeros(0, dtype=GENE_CODE_DTYPE)
+    order = np.argsort(pvals, kind='mergesort')
+
+    parent_dir = os.path.dirname(out_dir)
+    if not os.path.exists(parent_dir):
+        os.makedirs(parent_dir)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp', dir=parent_dir)
+    try:
+        pvals.take(order).tofile(os.path.join(tmp_dir, 'pvalues.bin'))
+        gene_codes.take(order).tofile(os.path.join(tmp_dir, 'genes.bin'))
+        index = {'version': STORE_VERSION, 'signature': list(signature),
+                 'num_pvalues': len(pvals), 'reports_pvalues': bool(reports_pvalues),
+                 'genes': gene_index.symbols}
+        with open(os.path.join(tmp_dir, 'index.json'), 'w') as handle:
+            json.dump(index, handle)
+
+        # replace a stale entry, another process may have written the
+        # same entry in the meantime
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, out_dir)
+        except OSError:
+            if PValueFile.open(out_dir, signature) is None:
+                raise
+            shutil.rmtree(tmp_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return PValueFile(out_dir)
+
+
+class PValueFile(object):
+    """Sorted p-values of one result file on disk.
+
+    The p-values are stored in increasing order in pvalues.bin, with
+    missing p-values last, and the code of each p-value's gene in
+    genes.bin. index.json holds the gene names and the signature of the
+    result file. Both arrays are opened with np.memmap, so p-values are
+    only read when used.
+
+    Parameters
+    ----------
+    out_dir : str
+        directory written by write_pvalue_file
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, 'index.json')) as handle:
+            index = json.load(handle)
+        if index['version'] != STORE_VERSION:
+            raise ValueError('P-value store entry {0} has an unsupported version'.format(out_dir))
+        self.signature = index['signature']
+        self.reports_pvalues = index['reports_pvalues']
+        self.genes = index['genes']
+        num_pvals = index['num_pvalues']
+        if num_pvals:
+            self.pvalues = np.memmap(os.path.join(out_dir, 'pvalues.bin'),
+                                     dtype=PVALUE_DTYPE, mode='r', shape=(num_pvals,))
+            self.gene_codes = np.memmap(os.path.join(out_dir, 'genes.bin'),
+                                        dtype=GENE_CODE_DTYPE, mode='r', shape=(num_pvals,))
+        else:
+            # empty files can not be memory-mapped
+            self.pvalues = np.zeros(0, dtype=PVALUE_DTYPE)
+            self.gene_codes = np.zeros(0, dtype=GENE_CODE_DTYPE)
+
+    @classmethod
+    def open(cls, out_dir, signature):
+        """Open an entry if it exists and matches the signature of its
+        result file, or return None."""
+        try:
+            pval_file = cls(out_dir)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        if pval_file.signature != list(signature):
+            return None
+        return pval_file
+
+    def keep_mask(self, blacklist):
+        """Boolean array over gene codes, plus a last entry for rows
+        without a gene, marking the genes not in the blacklist."""
+        gene_index = gene_sets.GeneIndex(self.genes)
+        is_black = gene_index.mask(blacklist, size=len(self.genes))
+        return np.append(~is_black, True)
+
+    def chunks(self, keep_mask=None):
+        """Iterate over the sorted p-values in chunks of SCAN_ROWS, leaving
+        out the genes not marked in keep_mask."""
+        for start in range(0, len(self.pvalues), SCAN_ROWS):
+            pvals = np.asarray(self.pvalues[start:start+SCAN_ROWS])
+            if keep_mask is not None:
+                pvals = pvals[keep_mask[self.gene_codes[start:start+SCAN_ROWS]]]
+            yield pvals
+
+    def mlfc_values(self, keep_mask=None):
+        """Get the sorted p-values scored by MLFC, leaving out the genes
+        not marked in keep_mask.
+
+        Missing p-values count as 1.0, so they are moved from the end to
+        before any p-values above one.
+        """
+        pvals = np.concatenate([np.zeros(0, dtype=PVALUE_DTYPE)] + list(self.chunks(keep_mask)))
+        num_missing = np.isnan(pvals).sum()
+        valid = pvals[:len(pvals)-num_missing]
+        num_upto_one = np.searchsorted(valid, 1.0, side='right')
+        return np.concatenate([valid[:num_upto_one], np.ones(num_missing),
+                               valid[num_upto_one:]])
+
+    def close(self):
+        """Drop the memory-mapped arrays."""
+        self.pvalues = self.gene_codes = None
+
+
+class PValueStore(object):
+    """Sorted p-values of many (method, cancer type) cells.
+
+    Each cell's result file has an entry written by write_pvalue_file, see
+    PValueFile. Entries kept in the cache directory are reused by later
+    runs while their result file does not change.
+
+    Parameters
+    ----------
+    files : dict
+        PValueFile of each cell
+    tmp_dir : str or None
+        temporary directory holding the entries, removed by close
+    """
+
+    def __init__(self, files, tmp_dir=None):
+        self._files = files
+        self.tmp_dir = tmp_dir
+
+    def keys(self):
+        """Get the key of every cell, in sorted order."""
+        return sorted(self._files)
+
+    def reports_pvalues(self, key):
+        """Whether the result file of a cell has p-values."""
+        return self._files[key].reports_pvalues
+
+    def pvalues_of(self, key):
+        """Get the memory-mapped p-values of a cell, sorted with missing
+        p-values last."""
+        return self._files[key].pvalues
+
+    def mlfc(self, blacklist=(), keys=None):
+        """Calculate the MLFC score of cells, leaving out the genes in the
+        blacklist.
+
+        The sorted p-values of cells are gathered into batches of about
+        MLFC_BATCH_ROWS and scored by
+        eval_stats.batch_mean_log_fold_change, so only a batch is in
+        memory at a time. Cells without p-values get a score of NaN.
+
+        Returns
+        -------
+        mlfc_dict : dict
+            MLFC score for each key
+        """
+        if keys is None:
+            keys = self.keys()
+        mlfc_dict = {}
+        batch_keys, batch_pvals = [], []
+        num_rows = 0
+        for key in keys:
+            pval_file = self._files[key]
+            if not pval_file.reports_pvalues:
+                mlfc_dict[key] = np.nan
+                continue
+            batch_keys.append(key)
+            batch_pvals.append(pval_file.mlfc_values(pval_file.keep_mask(blacklist)))
+            num_rows += len(batch_pvals[-1])
+            if num_rows >= MLFC_BATCH_ROWS:
+                mlfc_dict.update(batch_mlfc(batch_keys, batch_pvals))
+                batch_keys, batch_pvals = [], []
+                num_rows = 0
+        if batch_keys:
+            mlfc_dict.update(batch_mlfc(batch_keys, batch_pvals))
+        return mlfc_dict
+
+    def close(self):
+        """Close every entry, and delete the store if it is temporary."""
+        for pval_file in self._files.values():
+            pval_file.close()
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir)
+
+
+def batch_mlfc(keys, pvals_list):
+    """Score the sorted p-values of cells with the batched MLFC engine.
+
+    Parameters
+    ----------
+    keys : list
+        key of each cell
+    pvals_list : list
+        sorted p-values of each cell, see PValueFile.mlfc_values
+
+    Returns
+    -------
+    mlfc_dict : dict
+        MLFC score for each key
+    """
+    offsets = np.cumsum([0] + [len(pvals) for pvals in pvals_list])
+    scores = eval_stats.batch_mean_log_fold_change(np.concatenate(pvals_list), offsets,
+                                                   is_sorted=True)
+    return dict(zip(keys, scores))
+
+
+def open_pvalue_store(result_store, cell_paths):
+    """Open the p-values of result files as a p-value store.
+
+    With a cache directory, the entries are kept in its pvalues
+    sub-directory and reused while their result file does not change.
+    Otherwise they are written to a temporary directory, which is removed
+    when the store is closed. New entries are made from the parsed result
+    file if the result store has it in memory or in its frame cache, and
+    else by reading the file in chunks.
+
+    Parameters
+    ----------
+    result_store : utils.ResultStore
+        result store whose config names the p-value columns
+    cell_paths : dict
+        result file of each (method, cancer type) cell
+    """
+    cache = result_store.cache
+    if cache is not None:
+        store_dir, tmp_dir = os.path.join(cache.cache_dir, STORE_DIR_NAME), None
+    else:
+        store_dir = tmp_dir = tempfile.mkdtemp(prefix='pvalues')
+
+    files = {}
+    num_written = 0
+    try:
+        with profiling.stage('loading'):
+            for key in sorted(cell_paths):
+                path = cell_paths[key]
+                gene_col, pval_col = utils.pvalue_columns(result_store.config, key[0])
+                out_dir = entry_dir(store_dir, path, gene_col, pval_col)
+                signature = frame_cache.file_signature(path)
+                if cache is not None and not cache.rebuild:
+                    files[key] = PValueFile.open(out_dir, signature)
+                    if files[key] is not None:
+                        continue
+
+                # use the parsed file if there is one
+                df = result_store.cached_frame(key[0], path)
+                if df is not None and gene_col in df.columns and pval_col in df.columns:
+                    chunks = [(df[gene_col].values, df[pval_col])]
+                else:
+                    chunks = read_pvalue_chunks(path, gene_col, pval_col)
+                files[key] = write_pvalue_file(out_dir, signature, chunks)
+                num_written += 1
+    except Exception:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+        raise
+    logger.info('Wrote {0} of {1} p-value files to {2}'.format(num_written, len(files), store_dir))
+    return PValueStore(files, tmp_dir=tmp_dir)
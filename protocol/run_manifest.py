@@ -0,0 +1,185 @@
+"""
+File: run_manifest.py
+Description: Content-addressed memoization of per-cell results between runs
+"""
+import hashlib
+import threading
+import pickle
+import json
+import os
+
+# logging
+import logging
+logger = logging.getLogger(__name__)
+
+# bump whenever the layout of cached cell results changes
+MANIFEST_VERSION = 2
+
+# config entries of a method that change its per-cell results
+CELL_CONFIG_KEYS = ['threshold', 'level', 'pvalue', 'gene_col']
+
+
+def sha1_file(path, block_size=1 << 20):
+    """SHA-1 digest of a file's content."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sha1_json(obj):
+    """SHA-1 digest of a JSON serializable object."""
+    obj_str = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha1(obj_str.encode('utf-8')).hexdigest()
+
+
+class RunManifest(object):
+    """Records what went into a run, and the results of each (method,
+    cancer type) cell keyed by the content of its inputs.
+
+    The manifest itself is a JSON file with the SHA-1 of every result
+    file, the relevant config section of every method, the reference
+    lists and the cell key used by each stage. Cell results are pickled
+    under cell_dir by key, so a stage only recomputes the cells whose
+    result file, config or other inputs changed. A result file is only
+    re-hashed when its size or modification time changed since the
+    manifest was written.
+
+    Parameters
+    ----------
+    path : str
+        path of the JSON manifest
+    cell_dir : str
+        directory holding the cached cell results
+    rebuild : bool
+        ignore existing cell results and overwrite them
+    """
+
+    def __init__(self, path, cell_dir, rebuild=False):
+        self.path = path
+        self.cell_dir = cell_dir
+        self.rebuild = rebuild
+        self._lock = threading.Lock()
+        self._config_digests = {}
+        self.manifest = {'version': MANIFEST_VERSION, 'inputs': {}, 'config': {},
+                         'reference_lists': {}, 'cells': {}}
+        if os.path.exists(path):
+            try:
+                with open(path) as handle:
+                    previous = json.load(handle)
+            except ValueError:
+                logger.debug('Unreadable run manifest {0}'.format(path))
+                previous = {}
+            if previous.get('version') == MANIFEST_VERSION:
+                self.manifest.update(previous)
+        if not os.path.exists(cell_dir):
+            os.makedirs(cell_dir)
+
+    def file_digest(self, path):
+        """Get the SHA-1 of a file, reusing the recorded one if the file
+        has the same size and modification time."""
+        full_path = os.path.abspath(path)
+        st = os.stat(full_path)
+        with self._lock:
+            entry = self.manifest['inputs'].get(full_path)
+        if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            entry = {'size': st.st_size, 'mtime': st.st_mtime,
+                     'sha1': sha1_file(full_path)}
+            with self._lock:
+                self.manifest['inputs'][full_path] = entry
+        return entry['sha1']
+
+    def record_config(self, config):
+        """Record the config section of every method that affects its
+        results, and whether the method is excluded."""
+        exclude = config.get('exclude') or []
+        for method_name in config:
+            if method_name == 'exclude' or not isinstance(config[method_name], dict):
+                continue
+            section = {k: config[method_name].get(k) for k in CELL_CONFIG_KEYS}
+            self._config_digests[method_name] = sha1_json(section)
+            self.manifest['config'][method_name] = {'sha1': self._config_digests[method_name],
+                                                    'excluded': method_name in exclude}
+
+    def record_reference_list(self, name, path):
+        """Record the SHA-1 of a reference gene list."""
+        self.manifest['reference_lists'][name] = {'path': os.path.abspath(path),
+                                                  'sha1': self.file_digest(path)}
+
+    def cell_key(self, stage_name, method_name, path, level='gene', extra=''):
+        """Get the content-addressed key of a cell's result.
+
+        The key combines the stage, the result file content, the config
+        section of the method, the level and any extra inputs of the stage
+        (e.g. the digest of a gene list).
+        """
+        key_str = '\t'.join([str(MANIFEST_VERSION), stage_name, self.file_digest(path),
+                             self._config_digests.get(method_name, ''), level, extra])
+        return hashlib.sha1(key_str.encode('utf-8')).hexdigest()
+
+    def _cell_path(self, stage_name, key):
+        return os.path.join(self.cell_dir, stage_name, key + '.pkl')
+
+    def get(self, stage_name, key):
+        """Return the cached result of a cell, or None if missing."""
+        if self.rebuild:
+            return None
+        cell_path = self._cell_path(stage_name, key)
+        if not os.path.exists(cell_path):
+            return None
+        try:
+            with open(cell_path, 'rb') as handle:
+                return pickle.load(handle)
+        except Exception:
+            logger.debug('Unreadable cell result {0}'.format(cell_path))
+            return None
+
+    def put(self, stage_name, key, value):
+        """Save the result of a cell."""
+        cell_path = self._cell_path(stage_name, key)
+        stage_dir = os.path.dirname(cell_path)
+        if not os.path.exists(stage_dir):
+            try:
+                os.makedirs(stage_dir)
+            except OSError:
+                # created by another thread
+                pass
+
+        # write to a temporary file first so partial writes are never read
+        tmp_path = '{0}.{1}.tmp'.format(cell_path, os.getpid())
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, cell_path)
+
+    def record_cells(self, stage_name, method_name, cell_keys):
+        """Record the keys used for the cells of a method in a stage."""
+        with self._lock:
+            stage_cells = self.manifest['cells'].setdefault(stage_name, {})
+            stage_cells[method_name] = dict(cell_keys)
+
+    def save(self):
+        """Write the manifest to disk."""
+        with self._lock:
+            tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as handle:
+                json.dump(self.manifest, handle, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+
+
+def open_manifest(opts, config):
+    """Open the run manifest of the output directory.
+
+    Cell results are kept in the cache directory, so memoization is only
+    done when --cache-dir is given. Returns None otherwise.
+    """
+    if not opts.get('cache_dir'):
+        return None
+    manifest = RunManifest(os.path.join(opts['output'], 'run_manifest.json'),
+                           os.path.join(opts['cache_dir'], 'cells'),
+                           rebuild=opts.get('rebuild_cache', False))
+    manifest.record_config(config)
+    for list_opt in ['cgc', 'landscapes', 'kandoth', 'high_confidence_list', 'gene_list']:
+        if opts.get(list_opt):
+            manifest.record_reference_list(list_opt, opts[list_opt])
+    return manifest
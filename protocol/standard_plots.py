@@ -1,18 +1,8 @@
 import sys
 import argparse
-import utils
 import os
 import logging
-import pandas as pd
-import cgc_overlap
-import method_overlap
-import p_value
-import num_genes
-import consistency
-import plot_data
-import utils
-import numpy as np
-import config as cfg
+import profiling
 
 logger = logging.getLogger(__name__)  # module logger
 
@@ -75,9 +65,45 @@ def parse_arguments():
     parser.add_argument('-o', '--output',
                         type=str, default=None,
                          help=help_str)
+    help_str = ('Directory for caching parsed method result files. '
+                'Cached files are reused if the result file is unchanged (Default: no cache)')
+    parser.add_argument('--cache-dir',
+                        type=str, default=None,
+                        help=help_str)
+    help_str = 'Re-parse all result files and overwrite the cache (Default: False)'
+    parser.add_argument('--rebuild-cache',
+                        action='store_true', default=False,
+                        help=help_str)
+    help_str = 'Remove all cached files before running (Default: False)'
+    parser.add_argument('--clear-cache',
+                        action='store_true', default=False,
+                        help=help_str)
+    help_str = 'Number of processes used to read result files and render plots (Default: 1)'
+    parser.add_argument('-j', '--jobs',
+                        type=int, default=1,
+                        help=help_str)
+    help_str = ('Only write the data of each plot as a tab-delimited text file, '
+                'without rendering the plots (Default: False)')
+    parser.add_argument('--data-only',
+                        action='store_true', default=False,
+                        help=help_str)
+    help_str = ('Record the time, memory and I/O of each stage in '
+                'standard_plots.profile.json in the output directory (Default: False)')
+    parser.add_argument('--profile',
+                        action='store_true', default=False,
+                        help=help_str)
+    help_str = ('Also write a cProfile dump of the run to standard_plots.prof '
+                'in the output directory (Default: False)')
+    parser.add_argument('--cprofile',
+                        action='store_true', default=False,
+                        help=help_str)
 
     args = parser.parse_args()
 
+    # heavy modules are only imported once the arguments are valid and
+    # --help was not asked for
+    import utils
+
     # handle logging
     if args.log_level or args.log:
         if args.log:
@@ -107,152 +133,263 @@ def get_num_samples(df_dict):
     return num_sample_dict
 
 
-# get the average number of drivers per sample assuming all non-silent
-# mutations "count" for significant genes
-def get_avg_drivers(df_dict, sig_genes):
-    num_avg_drivers_dict = dict()
-    drivers_per_samp_dict = dict()
-    for ttype, df in df_dict.iteritems():
-        # handle samples
-        all_samples = df['Tumor_Sample_Barcode'].unique()
-        df = df[df['is_nonsilent']==1]  # keep nonsilent mutations
-        df = df.drop_duplicates(subset=['Tumor_Sample_Barcode', 'Hugo_Symbol'])
-
-        # count number of driver genes with non-silent mutations
-        if type(sig_genes) is dict:
-            if ttype not in sig_genes: continue
-            df_tmp = df[df['Hugo_Symbol'].isin(sig_genes[ttype])]
-        else:
-            df_tmp = df[df['Hugo_Symbol'].isin(sig_genes)]
-        num_drivers = df_tmp.groupby('Tumor_Sample_Barcode')['is_nonsilent'].sum()
-
-        # handle cases with samples with no driver genes mutated
-        no_drivers = list(set(all_samples) - set(num_drivers.index))
-        no_drivers_series = pd.Series(np.zeros(len(no_drivers)),
-                                      index=no_drivers)
-        num_drivers_per_samp = pd.concat([num_drivers, no_drivers_series])
+def read_maf(path, cancer_type_col, cache=None):
+    """Read the mutations needed for the drivers per sample analysis.
+
+    Only the used columns are kept, UTR/flank/RNA/intron mutations are
+    dropped and repetitive string columns are stored as categoricals. If
+    a frame cache is provided, the processed mutations are reused when
+    the MAF file has not changed.
+    """
+    import pandas as pd
+    import utils
+    cache_kind = 'maf:' + cancer_type_col
+    with profiling.stage('loading'):
+        if cache is not None:
+            mut_df = cache.get(path, cache_kind)
+            if mut_df is not None:
+                return mut_df
+
+        useful_cols = ['Hugo_Symbol', 'Variant_Classification',
+                       'Tumor_Sample_Barcode', cancer_type_col]
+        with utils.open_input(path) as handle:
+            mut_df = pd.read_table(handle, usecols=useful_cols)
+        profiling.record_read(path, rows=len(mut_df))
+        drop_variants = ["3'UTR", "5'UTR", "3'Flank", "5'Flank", "RNA", "Intron",]
+        mut_df = mut_df[~mut_df['Variant_Classification'].isin(drop_variants)]
+        mut_df['is_nonsilent'] = (mut_df['Variant_Classification']!='Silent').astype(int)
+        for col in ['Variant_Classification', cancer_type_col]:
+            mut_df[col] = mut_df[col].astype('category')
+
+        if cache is not None:
+            cache.put(path, cache_kind, mut_df)
+    return mut_df
+
+
+def qq_table(pvals, is_sorted=False):
+    """Sorted observed p-values with their expected quantiles under a
+    uniform distribution, as plotted by plot_data.single_method_qqplot.
+
+    Large sets of p-values are thinned, see eval_stats.thin_qq_points.
+    """
+    import pandas as pd
+    import eval_stats
+    expected, observed = eval_stats.thin_qq_points(pvals, log=True,
+                                                   max_points=eval_stats.QQ_MAX_POINTS,
+                                                   is_sorted=is_sorted)
+    return pd.DataFrame({'expected p-value': expected,
+                         'observed p-value': observed},
+                        columns=['expected p-value', 'observed p-value'])
+
+
+def driver_per_sample_table(driver_per_sample):
+    """Get the number of drivers of every sample as a long table, and the
+    cancer types ordered by their mean number of drivers per sample.
+
+    Parameters
+    ----------
+    driver_per_sample : dict
+        {tumor type: pd.Series} of driver counts per sample
+
+    Returns
+    -------
+    ttype_df : pd.DataFrame
+        tumor type and number of drivers of each sample
+    custom_order : pd.Index
+        tumor types sorted by their mean number of drivers per sample
+    """
+    import pandas as pd
+    driver_list = [pd.DataFrame({'tumor type': ttype, 'type': 'All Driver', '# Per Sample': count})
+                   for ttype, count in sorted(driver_per_sample.items())]
+    ttype_df = pd.concat(driver_list)
+    ttype_df['# Per Sample'] = ttype_df['# Per Sample'].astype(int)
+    mean_per_sample = ttype_df.groupby('tumor type')['# Per Sample'].mean()
+    custom_order = mean_per_sample.sort_values().index
+    return ttype_df, custom_order
+
+
+def _render_worker(task):
+    """Render one plot, run by the process pool in render_plots."""
+    import plot_data
+    plot_name, plot_args = task
+    getattr(plot_data, plot_name)(*plot_args)
+
+
+def render_plots(plot_list, jobs=1):
+    """Render plots with the matplotlib Agg backend.
+
+    Parameters
+    ----------
+    plot_list : list
+        (plot_data function name, arguments) of each plot
+    jobs : int
+        number of processes rendering plots
+    """
+    import multiprocessing
+    logger.info('Rendering {0} plots with {1} processes . . .'.format(len(plot_list), jobs))
+    if jobs > 1:
+        with profiling.child_cpu():
+            pool = multiprocessing.Pool(jobs)
+            try:
+                pool.map(_render_worker, plot_list, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+    else:
+        for task in plot_list:
+            _render_worker(task)
+    logger.info('Finished.')
 
-        num_avg_drivers_dict[ttype] = np.mean(num_drivers_per_samp)
-        drivers_per_samp_dict[ttype] = num_drivers_per_samp
-    return num_avg_drivers_dict, drivers_per_samp_dict
 
+def main(opts, store=None):
+    import numpy as np
+    import pandas as pd
+    import utils
+    import config as cfg
+    import cgc_overlap
+    import pvalue_store
+    import mutation_matrix
 
-def main(opts):
     # make output directory if it doesn't exist
     if not os.path.exists(opts['output']):
         os.makedirs(opts['output'])
 
     # load config file
-    config = utils.load_config(opts['config'])
+    if store is None:
+        config = utils.load_config(opts['config'])
+        store = utils.open_result_store(opts, config)
+    config = store.config
 
     # run commands
-    cgc = utils.process_cgc(opts['cgc'])
-    landscapes = cgc_overlap.read_custom_list(opts['landscapes'])
-    kandoth = cgc_overlap.read_custom_list(opts['kandoth'])
-    tamborero = cgc_overlap.read_custom_list(opts['high_confidence_list'])
+    ref_lists = cgc_overlap.read_reference_lists(opts, store.gene_index)
+    all_lists = ref_lists.union_genes()
 
+    # get significant genes
     gene_methods = cfg.fetch_level_names(config, level='gene')
-    for method_name in gene_methods:
-        logger.info('Analyzing: {0}'.format(method_name))
-
-        # make directory if it doesnt exist
-        meth_out_dir = os.path.join(opts['output'], method_name)
-        if not os.path.exists(meth_out_dir): os.makedirs(meth_out_dir)
-
-        # get significant genes
-        signif_dict = utils.fetch_single_method_significant(opts['input_dir'],
-                                                            method_name,
-                                                            config)
-
-        ###########################
-        # Pan-cancer plots
-        ###########################
-        is_pval = False
-        if 'PANCAN' in signif_dict:
-            # read pancancer data
-            pancan_df = pd.read_table(os.path.join(opts['input_dir'], method_name, 'PANCAN.txt'))
-
-            # overlap with gene lists
-            logger.info('Overlapping genes with CGC, Cancer Genome Landscapes, kandoth et al, and tamborero et al. . . .')
-            pancan_genes = set(signif_dict['PANCAN'])
-            intersect_cgc = len(pancan_genes & set(cgc))
-            intersect_landscapes = len(pancan_genes & set(landscapes))
-            intersect_kandoth = len(pancan_genes & set(kandoth))
-            intersect_tamborero = len(pancan_genes & set(tamborero))
-            all_lists = (set(cgc) | set(landscapes) | set(kandoth) | set(tamborero))
-            intersect_all = len(pancan_genes & all_lists)
-            s = pd.Series([intersect_cgc, intersect_landscapes, intersect_kandoth, intersect_tamborero, intersect_all],
-                        index=['CGC', 'Landscapes', 'Kandoth et al.', 'Tamborero et al.', 'Any list'])
-            s = s / len(pancan_genes)
-            out_path = os.path.join(opts['output'], method_name, 'gene_list_overlap.pdf')
-            plot_data.single_method_overlap(s, out_path)
-            logger.info('Finished')
-
-            # qq-plot
-            # figure out which columns are being used
-            pval_col = 'pvalue'
-            is_pval = pancan_df[pval_col].iloc[0] != '.'
+    all_signif_dict = store.fetch_significant(level='gene')
+
+    # overlap of the pan-cancer genes of every method with each gene list
+    calls = store.fetch_call_matrix(level='gene')
+    with profiling.stage('overlap'):
+        list_masks = ref_lists.masks(len(calls.genes))
+        list_masks = np.vstack([list_masks, list_masks.any(axis=0)])
+        list_names = ref_lists.names + ['Any list']
+        if 'PANCAN' in calls.cancer_types:
+            pancan_ovlp = calls.overlap_counts(list_masks)[calls.cancer_types.index('PANCAN')]
+
+    # sorted p-values of every result file, memory-mapped so they are
+    # never all in memory
+    cell_paths = {(method_name, cancer_type): full_path
+                  for method_name in gene_methods
+                  for cancer_type, full_path in utils.list_method_files(store.input_dir, method_name)}
+    pval_store = pvalue_store.open_pvalue_store(store, cell_paths)
+
+    # drivers per sample are computed for all methods at once, when first needed
+    cancer_type_col = opts['tumor_type_col']
+    all_driver_per_sample = None
+
+    plots = []
+    try:
+        # MLFC scores of every method and cancer type at once
+        logger.info('Analyzing the divergence of p-values from expectations . . .')
+        with profiling.stage('mlfc'):
+            all_mlfc = pval_store.mlfc(all_lists)
+
+        for method_name in gene_methods:
+            logger.info('Analyzing: {0}'.format(method_name))
+
+            # make directory if it doesnt exist
+            meth_out_dir = os.path.join(opts['output'], method_name)
+            if not os.path.exists(meth_out_dir): os.makedirs(meth_out_dir)
+
+            signif_dict = dict(all_signif_dict[method_name])
+
+            ###########################
+            # Pan-cancer plots
+            ###########################
+            is_pval = False
+            if 'PANCAN' in signif_dict:
+                # overlap with gene lists
+                logger.info('Overlapping genes with CGC, Cancer Genome Landscapes, kandoth et al, and tamborero et al. . . .')
+                num_pancan = len(set(signif_dict['PANCAN']))
+                s = pd.Series(pancan_ovlp[calls.methods.index(method_name)],
+                              index=list_names)
+                s = s / float(num_pancan)
+                out_path = os.path.join(meth_out_dir, 'gene_list_overlap.pdf')
+                table = s.rename_axis('list').to_frame('fraction overlap')
+                plots.append((out_path, table, 'single_method_overlap', (s, out_path)))
+
+                # qq-plot
+                is_pval = pval_store.reports_pvalues((method_name, 'PANCAN'))
+                if is_pval:
+                    out_path = os.path.join(meth_out_dir, 'qq_plot.png')
+                    table = qq_table(pval_store.pvalues_of((method_name, 'PANCAN')),
+                                     is_sorted=True)
+                    plots.append((out_path, table, 'single_method_qqplot', (table, out_path)))
+
+            ###########################
+            # Cancer type specific plots
+            ###########################
+            if 'PANCAN' in signif_dict:
+                del signif_dict['PANCAN']
+            if not signif_dict:
+                break
+            # process maf file
+            if all_driver_per_sample is None:
+                logger.info('Counting drivers per sample for all methods . . .')
+                mut_df = read_maf(opts['mutations'], cancer_type_col,
+                                  cache=store.cache)
+                mut_matrix = mutation_matrix.MutationMatrix(mut_df, cancer_type_col)
+                del mut_df
+                ttype_signif_dict = {m: {t: all_signif_dict[m][t]
+                                         for t in all_signif_dict[m]
+                                         if t != 'PANCAN'}
+                                     for m in all_signif_dict}
+                with profiling.stage('overlap'):
+                    all_driver_per_sample = mut_matrix.drivers_per_sample(ttype_signif_dict)
+
+            # number of drivers per sample
+            ttype_df, order = driver_per_sample_table(all_driver_per_sample[method_name])
+            out_path = os.path.join(meth_out_dir, 'cancer_type_per_sample.pdf')
+            plots.append((out_path, ttype_df, 'single_method_driver_per_sample',
+                          (ttype_df, order, out_path)))
+
+            # number of driver genes
+            signif_ct = pd.Series({k: len(signif_dict[k]) for k in signif_dict})
+            out_path = os.path.join(meth_out_dir, 'cancer_type_num_drivers.pdf')
+            table = signif_ct[order].rename_axis('cancer type').to_frame('No. of significant genes')
+            plots.append((out_path, table, 'single_method_num_drivers_per_type',
+                          (signif_ct, order, out_path)))
+
+            # the MLFC scores
             if is_pval:
-                logger.info('Creating p-value QQ plot . . .')
-                out_path = os.path.join(opts['output'], method_name, 'qq_plot.png')
-                plot_data.single_method_qqplot(pancan_df[pval_col], out_path)
-                logger.info('Finished.')
-
-        ###########################
-        # Cancer type specific plots
-        ###########################
-        cancer_type_col = opts['tumor_type_col']
-        if 'PANCAN' in signif_dict:
-            del signif_dict['PANCAN']
-        if not signif_dict:
-            return
-        # process maf file
-        useful_cols = ['Hugo_Symbol', 'Chromosome', 'Start_Position',
-                    'End_Position', 'Strand', 'Variant_Classification',
-                    'Variant_Type', 'Reference_Allele', 'Tumor_Seq_Allele1',
-                    'Tumor_Seq_Allele2', 'Tumor_Sample_Barcode', 'Transcript_ID',
-                    'HGVSp_Short', 'Protein_position', 'CENTERS', 'FILTER',
-                    't_depth', 't_alt_count', cancer_type_col]
-        mut_df = pd.read_table(opts['mutations'], usecols=useful_cols)
-        drop_variants = ["3'UTR", "5'UTR", "3'Flank", "5'Flank", "RNA", "Intron",]
-        mut_df = mut_df[~mut_df['Variant_Classification'].isin(drop_variants)]
-        mut_df['is_nonsilent'] = 0
-        mut_df.loc[mut_df['Variant_Classification']!='Silent', 'is_nonsilent'] = 1
-
-        # plot number of drivers per sample
-        logger.info('Analyzing number of drivers per sample . . .')
-        ttype_data = dict()
-        for ttype in mut_df[cancer_type_col].dropna().unique():
-            ttype_data[ttype] = mut_df[mut_df[cancer_type_col]==ttype].copy()
-        driver_mean, driver_per_sample = get_avg_drivers(ttype_data, signif_dict)
-        out_path = os.path.join(opts['output'], method_name, 'cancer_type_per_sample.pdf')
-        order = plot_data.single_method_driver_per_sample(driver_per_sample,
-                                                          out_path)
-        logger.info('Finished.')
-
-        # plot number of driver genes
-        logger.info('Analyzing number of driver in each cancer type . . .')
-        signif_ct = pd.Series({k: len(signif_dict[k]) for k in signif_dict})
-        out_path = os.path.join(opts['output'], method_name, 'cancer_type_num_drivers.pdf')
-        plot_data.single_method_num_drivers_per_type(signif_ct, order, out_path)
-        logger.info('Finished.')
-
-        # plot the MLFC scores
-        if is_pval:
-            logger.info('Analyzing the divergence of p-values from expectations . . .')
-            pval_dict = utils.read_filtered_pvalues(opts['input_dir'], all_lists,
-                                                    config, method_name)
-            mlfc_dict = {t: p_value.calculate_mlfc(pval_dict[t], method_name, config)
-                        for t in pval_dict}
-            mlfc_series = pd.Series(mlfc_dict)
-            out_path = os.path.join(opts['output'], method_name, 'cancer_type_mlfc.pdf')
-            plot_data.mlfc_score(mlfc_series, out_path)
-            logger.info('Finished.')
+                mlfc_series = pd.Series({k[1]: all_mlfc[k] for k in all_mlfc
+                                         if k[0] == method_name})
+                out_path = os.path.join(meth_out_dir, 'cancer_type_mlfc.pdf')
+                table = mlfc_series.sort_values(ascending=False).rename_axis('cancer type').to_frame('MLFC')
+                plots.append((out_path, table, 'mlfc_score', (mlfc_series, out_path)))
+    finally:
+        pval_store.close()
+
+    if opts['data_only']:
+        # write the plot data next to where each plot would be
+        with profiling.stage('writing'):
+            for out_path, table, plot_name, plot_args in plots:
+                table_path = os.path.splitext(out_path)[0] + '.txt'
+                table.to_csv(table_path, sep='\t')
+        logger.info('Wrote the data of {0} plots.'.format(len(plots)))
+    else:
+        with profiling.stage('plotting'):
+            render_plots([(plot_name, plot_args)
+                          for out_path, table, plot_name, plot_args in plots],
+                         jobs=store.jobs)
 
 
 def cli_main():
     opts = parse_arguments()
-    main(opts)
+    if not os.path.exists(opts['output']):
+        os.makedirs(opts['output'])
+    profiling.run_profiled(main, opts, 'standard_plots')
 
 
 if __name__ == '__main__':
@@ -1,5 +1,4 @@
 import pandas as pd
-from scipy import stats
 import numpy as np
 import yaml
 
@@ -10,11 +9,63 @@ import datetime
 import os
 import sys
 import config as cfg
-import csv
+import frame_cache
+import run_manifest
+import call_matrix
+import gene_sets
+import profiling
+import multiprocessing
+import threading
+import gzip
+import bz2
+import io
 import re
+try:
+    import lzma
+except ImportError:
+    # python 2 needs the backports.lzma package for .xz files
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    # optional, only needed for .zst files
+    zstandard = None
 
 logger = logging.getLogger(__name__)  # module logger
 
+# extensions of compressed input files that are decompressed on the fly
+COMPRESSION_EXTS = ['.gz', '.bz2', '.xz', '.zst']
+
+# result file columns that are always read, as strings
+RESULT_STR_COLUMNS = ['gene', 'transcript', 'protein_change', 'info']
+
+# result file columns with few distinct values, parsed as categories
+# when thresholding a result file while reading it
+CATEGORICAL_COLUMNS = ['info']
+
+# rows per chunk when reading a result file in chunks, e.g. when
+# thresholding it while reading or copying its p-values
+CHUNK_ROWS = 100000
+
+# levels whose rows are named by a (gene, transcript, protein_change) key,
+# and the column naming the rows of the other levels
+KEY_LEVELS = ['variant', 'residue']
+KEY_COLUMNS = ['gene', 'transcript', 'protein_change']
+LEVEL_COLUMNS = {'gene': 'gene', 'cna': 'gene'}
+
+# INFO keys added as columns of a parsed result file, any other keys are
+# left in the info column
+INFO_KEYS = ['FILTER', 'PROT_RANGE']
+
+# INFO keys stored as categoricals, since they take few distinct values
+CATEGORICAL_INFO_KEYS = ['FILTER']
+
+# rows with a FILTER starting with one of these are never significant
+FAIL_FILTERS = ('FAIL', 'LGF', 'LDA')
+
 def start_logging(log_file='', log_level='INFO', verbose=False):
     """Start logging information into the log directory.
 
@@ -62,121 +113,571 @@ def start_logging(log_file='', log_level='INFO', verbose=False):
         root.propagate = True
 
 
-def fetch_significant(input_dir, config, level='gene'):
-    """Read the significant driver genes for each method."""
-    signif_dict = {}
-    method_list = cfg.fetch_level_names(config, level=level)
-    signif_dict = {}
-    for method_name in method_list:
-        method_signif_dict = fetch_single_method_significant(input_dir,
-                                                             method_name,
-                                                             config,
-                                                             level=level)
-        signif_dict[method_name] = method_signif_dict
-    return signif_dict
-
-
-def read_residue_method(path):
-    with open(path) as handle:
-        myreader = csv.reader(handle, delimiter='\t')
-
-        # parse header
-        header = next(myreader)
-        pc_ix = header.index('protein_change')
-        info_ix = header.index('info')
-
-        # iterate through each line
-        output_list = []
-        for line in myreader:
-            # tmp copy
-            tmp = list(line)
-
-            # see if prot range specified
-            if len(line) < len(header):
-                matches = False
-            else:
-                matches = re.findall('PROT_RANGE=([0-9\-,]*)[;$]', line[info_ix])
-            if matches:
-                pos_list = matches[0].split(',')
-                for pos in pos_list:
-                    if '-' in pos:
-                        # add all residues in a range
-                        pos_split = map(int, pos.split('-'))
-                        for p in range(pos_split[0], pos_split[1]+1):
-                            tmp[pc_ix] = str(p)
-                            output_list.append(tmp)
-                    else:
-                        tmp[pc_ix] = pos
-                        output_list.append(list(tmp))
+def strip_compression_ext(path):
+    """Remove a compression extension (e.g. LUAD.txt.gz -> LUAD.txt)."""
+    base, ext = os.path.splitext(path)
+    return base if ext in COMPRESSION_EXTS else path
+
+
+def open_input(path, text=False):
+    """Open an input file for reading.
+
+    Files ending in .gz, .bz2, .xz or .zst are decompressed as they are
+    read, without writing a temporary file. The handle is binary unless
+    text is True.
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.gz':
+        handle = gzip.open(path, 'rb')
+    elif ext == '.bz2':
+        handle = bz2.BZ2File(path, 'rb')
+    elif ext == '.xz':
+        if lzma is None:
+            raise ImportError('Reading {0} requires the lzma module '
+                              '(backports.lzma on python 2)'.format(path))
+        handle = lzma.open(path, 'rb')
+    elif ext == '.zst':
+        if zstandard is None:
+            raise ImportError('Reading {0} requires the zstandard package'.format(path))
+        handle = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    else:
+        handle = open(path, 'rb')
+    if text and sys.version_info[0] >= 3:
+        handle = io.TextIOWrapper(handle, encoding='utf-8')
+    return handle
+
+
+def read_header(path):
+    """Get the column names of a tab-separated file."""
+    with open_input(path, text=True) as handle:
+        return handle.readline().rstrip('\r\n').split('\t')
+
+
+def method_columns(config, method_name):
+    """Get the result file columns used for a method by any sub-command.
+
+    These are the gene, transcript, protein_change, info and pvalue
+    columns, plus the threshold column and any p-value or gene columns
+    named in the method's config.
+    """
+    cols = RESULT_STR_COLUMNS + ['pvalue']
+    if cfg.is_valid_config(config, method_name, 'threshold'):
+        thresh_col = cfg.fetch_threshold(config, method_name)[0]
+        cols.append('score' if thresh_col == 'rank' else thresh_col)
+    for attr in ['pvalue', 'consistency']:
+        if cfg.is_valid_config(config, method_name, attr):
+            cols += list(config[method_name][attr])
+    if cfg.is_valid_config(config, method_name, 'gene_col'):
+        cols.append(config[method_name]['gene_col'])
+    return [c for i, c in enumerate(cols) if c not in cols[:i]]
+
+
+def pvalue_columns(config, method_name):
+    """Get the gene and p-value column names of a method."""
+    if cfg.is_valid_config(config, method_name, 'gene_col'):
+        gene_col = config[method_name]['gene_col']
+    else:
+        gene_col = 'gene'
+    if cfg.is_valid_config(config, method_name, 'pvalue'):
+        pval_col = config[method_name]['pvalue'][0]
+    else:
+        pval_col = 'pvalue'
+    return gene_col, pval_col
+
+
+def _project_columns(path, usecols):
+    """Get the wanted columns that a file has, in file order."""
+    if usecols is None:
+        return None
+    return [c for c in read_header(path) if c in usecols]
+
+
+def parse_info(info, keys=None):
+    """Split a column of semicolon-delimited KEY=VALUE pairs into a column
+    for each key.
+
+    Info strings repeat a lot (e.g. FILTER=PASS;), so each distinct string
+    is split once and the pieces are spread back to the rows. The FILTER
+    key is categorical.
+
+    Parameters
+    ----------
+    info : pd.Series
+        info column of a result file
+    keys : list or None
+        only parse these keys, or every key if None
+
+    Returns
+    -------
+    info_df : pd.DataFrame
+        one column per key with the same index as info, missing where a
+        row does not have the key. There is always a FILTER column when
+        FILTER is parsed.
+    """
+    row_codes, uniq_info = pd.factorize(info.fillna('').astype(str))
+    uniq_info = pd.Series(uniq_info)
+    info_df = pd.DataFrame(index=info.index)
+    if len(uniq_info):
+        # split every distinct info string into its KEY=VALUE pieces
+        pieces_per_info = uniq_info.str.count(';').values + 1
+        pieces = np.array(';'.join(uniq_info.tolist()).split(';'))
+        piece_info_ix = np.repeat(np.arange(len(uniq_info)), pieces_per_info)
+        piece_keys, _, values = np.char.partition(pieces, '=').T
+        piece_keys = np.char.strip(piece_keys)
+
+        # one column per key
+        found_keys = np.unique(piece_keys[piece_keys != ''])
+        if keys is not None:
+            found_keys = [k for k in found_keys if str(k) in keys]
+        for key in found_keys:
+            is_key = piece_keys == key
+            uniq_vals = np.empty(len(uniq_info), dtype=object)
+            uniq_vals[:] = np.nan
+            uniq_vals[piece_info_ix[is_key]] = values[is_key].astype(object)
+            if str(key) in CATEGORICAL_INFO_KEYS:
+                val_codes, categories = pd.factorize(uniq_vals)
+                info_df[str(key)] = pd.Categorical.from_codes(val_codes.take(row_codes), categories)
             else:
-                # quick hack to fix formatting problems
-                if len(tmp) < len(header): tmp.append('')
-                output_list.append(tmp)
+                info_df[str(key)] = uniq_vals.take(row_codes)
+    for key in CATEGORICAL_INFO_KEYS:
+        if key not in info_df.columns and (keys is None or key in keys):
+            info_df[key] = pd.Categorical([np.nan]*len(info_df))
+    return info_df
 
-        # create data frame
-        final_df = pd.DataFrame(output_list, columns=header)
-        return final_df
 
+def add_info_columns(df):
+    """Add the INFO_KEYS of the info column of a result data frame as
+    columns, see parse_info. Existing columns are never replaced."""
+    missing_keys = [key for key in INFO_KEYS if key not in df.columns]
+    if 'info' not in df.columns or not missing_keys:
+        return df
+    info_df = parse_info(df['info'], keys=missing_keys)
+    for key in info_df.columns:
+        df[key] = info_df[key].values
+    return df
 
-def fetch_single_method_significant(input_dir, method_name, config, level='gene'):
-    """Read the significant driver genes for a single method."""
-    signif_dict = {}
-    meth_input_dir = os.path.join(input_dir, method_name)
-    for method_file in os.listdir(meth_input_dir):
-        if not method_file.endswith('.txt'): continue
-        if method_file.upper().startswith('README'): continue
-        cancer_type_name = os.path.splitext(method_file)[0]
 
-        # read in data
-        full_path = os.path.join(meth_input_dir, method_file)
+def read_residue_method(path, usecols=None):
+    """Read a residue level result file.
+
+    Rows with a PROT_RANGE entry in the info column are expanded to one
+    row for each listed residue, with the residue position stored in the
+    protein_change column.
+    """
+    with open_input(path) as handle:
+        df = pd.read_table(handle, dtype=str, keep_default_na=False,
+                           usecols=_project_columns(path, usecols))
+
+    # find the residues listed for each row
+    add_info_columns(df)
+    if 'PROT_RANGE' not in df.columns:
+        return df
+    prot_range = df['PROT_RANGE']
+    has_range = prot_range.notnull().values
+    range_values = prot_range.values[has_range]
+    # the ranges of all rows are joined by ';', which can not be part of
+    # an info value, and split at once
+    joined = ';'.join(range_values)
+    if re.search('[^0-9\-,;]', joined):
+        has_range[has_range] = prot_range[has_range].str.match('^[0-9\-,]*$').values.astype(bool)
+        range_values = prot_range.values[has_range]
+        joined = ';'.join(range_values)
+    if not has_range.any():
+        return df
+    range_ix = np.flatnonzero(has_range)
+
+    # split the comma separated residues/ranges into tokens, along with
+    # the separator before and after each token
+    parts = re.split('([,;-])', joined)
+    tokens = np.array(parts[0::2], dtype=object)
+    sep_after = np.array(parts[1::2] + [';'])
+    sep_before = np.append(';', sep_after[:-1])
+
+    # a piece is a residue, or a range from a token to the next one
+    is_start = sep_before != '-'
+    is_span_token = is_start & (sep_after == '-')
+    pieces = tokens[is_start]
+    piece_row_ix = range_ix[np.cumsum(sep_before == ';')[is_start] - 1]
+    is_span = is_span_token[is_start]
+
+    # figure out the first residue and number of residues for each piece
+    num_residues = np.ones(len(pieces), dtype=int)
+    first_pos = np.zeros(len(pieces), dtype=int)
+    if is_span.any():
+        span_ix = np.flatnonzero(is_span_token)
+        span_start = tokens[span_ix].astype(int)
+        span_end = tokens[span_ix+1].astype(int)
+        first_pos[is_span] = span_start
+        num_residues[is_span] = np.maximum(span_end - span_start + 1, 0)
+
+    # expand each piece into its residues
+    piece_offset = np.cumsum(num_residues) - num_residues
+    residue_ix = np.arange(num_residues.sum()) - np.repeat(piece_offset, num_residues)
+    residue_pos = np.repeat(first_pos, num_residues) + residue_ix
+    max_pos = residue_pos.max() if len(residue_pos) else 0
+    pos_names = np.arange(max_pos+1).astype(str).astype(object)
+    range_prot_change = np.where(np.repeat(is_span, num_residues),
+                                 pos_names.take(residue_pos),
+                                 np.repeat(pieces, num_residues))
+
+    # repeat each row once per residue, keeping the original row order
+    rows_per_line = np.ones(len(df), dtype=int)
+    residues_per_line = np.bincount(piece_row_ix, weights=num_residues,
+                                    minlength=len(df))
+    rows_per_line[range_ix] = residues_per_line[range_ix].astype(int)
+    row_ix = np.repeat(np.arange(len(df)), rows_per_line)
+    final_df = pd.DataFrame({c: df[c].values.take(row_ix) for c in df.columns},
+                            columns=df.columns)
+    prot_change = final_df['protein_change'].values
+    prot_change[np.repeat(has_range, rows_per_line)] = range_prot_change
+    final_df['protein_change'] = prot_change
+    return final_df
+
+
+def key_codes(df):
+    """Get an integer code for the (gene, transcript, protein_change) key
+    of each row, used to name variants and residues.
+
+    The codes of the three columns are combined arithmetically, so no key
+    strings are made. Use render_keys to get the names of codes.
+
+    Returns
+    -------
+    codes : np.ndarray
+        key code of each row, -1 where the gene or transcript is missing
+    col_uniques : list
+        distinct values of each key column, needed by render_keys
+    """
+    col_codes, col_uniques = [], []
+    for col in KEY_COLUMNS:
+        vals = df[col].astype(str) if col == 'protein_change' else df[col]
+        codes, uniques = pd.factorize(vals)
+        col_codes.append(codes.astype(np.int64))
+        col_uniques.append(uniques)
+    num_transcripts, num_changes = len(col_uniques[1]), len(col_uniques[2])
+    codes = (col_codes[0] * num_transcripts + col_codes[1]) * num_changes + col_codes[2]
+    codes[(col_codes[0] < 0) | (col_codes[1] < 0)] = -1
+    return codes, col_uniques
+
+
+def render_keys(codes, col_uniques):
+    """Get gene_transcript_proteinchange names for codes from key_codes.
+
+    Missing keys (-1) are NaN.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    num_transcripts, num_changes = len(col_uniques[1]), len(col_uniques[2])
+    is_valid = codes >= 0
+    valid_codes = codes[is_valid]
+    gene_ix = valid_codes // (num_transcripts * num_changes)
+    transcript_ix = (valid_codes // num_changes) % num_transcripts
+    change_ix = valid_codes % num_changes
+    names = np.empty(len(codes), dtype=object)
+    names[:] = np.nan
+    names[is_valid] = ['_'.join(key) for key in zip(col_uniques[0].take(gene_ix),
+                                                    col_uniques[1].take(transcript_ix),
+                                                    col_uniques[2].take(change_ix))]
+    return names
+
+
+def level_names(df, level='gene'):
+    """Get the gene, variant or residue name of each row.
+
+    For variants and residues, names are only rendered for distinct keys.
+    """
+    if level not in KEY_LEVELS:
+        return df[LEVEL_COLUMNS.get(level, level)].values
+    codes, col_uniques = key_codes(df)
+    uniq_codes, row_ix = np.unique(codes, return_inverse=True)
+    return render_keys(uniq_codes, col_uniques).take(row_ix)
+
+
+def frame_kind(level='gene', usecols=None):
+    """Kind of parsing of a result file, which keys it in the frame cache."""
+    kind = 'residue' if level == 'residue' else 'table'
+    if usecols is not None:
+        kind += ':' + ','.join(sorted(set(RESULT_STR_COLUMNS) | set(usecols)))
+    return kind
+
+
+def read_method_file(path, level='gene', cache=None, usecols=None):
+    """Read a single method result file.
+
+    A column for each of INFO_KEYS in the info column (see parse_info) is
+    added to the parsed data. Variant and residue names are not stored, see
+    key_codes. If usecols is given, only those columns (and the gene, transcript,
+    protein_change and info columns) are read, see method_columns. If a
+    frame cache is provided, previously parsed data is reused when the
+    file has not changed.
+    """
+    if usecols is not None:
+        usecols = sorted(set(RESULT_STR_COLUMNS) | set(usecols))
+    kind = frame_kind(level, usecols)
+    with profiling.stage('loading'):
+        if cache is not None:
+            df = cache.get(path, kind)
+            if df is not None:
+                return df
+
+        # parse the file
         if level == 'residue':
-            df = read_residue_method(full_path)
+            df = read_residue_method(path, usecols=usecols)
         else:
-            df = pd.read_table(full_path)
-        df['variant'] = df['gene'] + '_' + df['transcript'] + '_' + df['protein_change'].astype(str)
-        df['residue'] = df['gene'] + '_' + df['transcript'] + '_' + df['protein_change'].astype(str)
-        df['cna'] = df['gene']
-
-        # get the treshold for significance
-        thresh_col, score_val, top_direction = cfg.fetch_threshold(config, method_name)
-
-        # work around for rank based selection
-        if thresh_col == 'rank':
-            rank_order = True if top_direction=='low' else False
-            df['rank'] = df['score'].rank(ascending=rank_order)
-
-        # figure out if a custom score or q-value is used
-        tmp_result = set()
-        if cfg.is_valid_config(config, method_name, 'threshold'):
-            # get the top scoring genes
-            #top_direction = config[method_name]['threshold']['top']
-            if thresh_col == 'rank':
-                signif_df = df[df[thresh_col].astype(float)<=score_val]
-            elif top_direction == 'low':
-                signif_df = df[df[thresh_col].astype(float)<=score_val]
-            else:
-                signif_df = df[df[thresh_col].astype(float)>=score_val]
+            str_dtypes = {c: str for c in RESULT_STR_COLUMNS}
+            with open_input(path) as handle:
+                df = pd.read_table(handle, dtype=str_dtypes,
+                                   usecols=_project_columns(path, usecols))
+        profiling.record_read(path, rows=len(df))
+        add_info_columns(df)
+
+        if cache is not None:
+            cache.put(path, kind, df)
+    return df
+
+
+def read_significant_cell(path, method_name, config, level='gene', cache=None):
+    """Find the significant genes of a result file.
+
+    The parsed file in the frame cache is used if there is one. Otherwise
+    only the key, info and threshold columns are read, in chunks, with
+    the info column parsed as a category. The rows of each chunk that
+    fail the threshold are dropped before the rest of the parsing. Rank
+    thresholds depend on every score, so for those all rows are kept.
+    Residue level files are read in full with read_method_file, since
+    their rows are expanded by PROT_RANGE.
+
+    Returns
+    -------
+    cell : dict
+        same as significant_cell
+    """
+    usecols = method_columns(config, method_name)
+    if level == 'residue':
+        df = read_method_file(path, level=level, cache=cache, usecols=usecols)
+        return significant_cell(df, method_name, config, level=level)
+    if cache is not None:
+        with profiling.stage('loading'):
+            df = cache.get(path, frame_kind(level, usecols))
+        if df is not None:
+            return significant_cell(df, method_name, config, level=level)
+
+    thresh_col = cfg.fetch_threshold(config, method_name)[0]
+    is_rank = thresh_col == 'rank'
+    value_col = 'score' if is_rank else thresh_col
+    dtypes = {c: str for c in RESULT_STR_COLUMNS}
+    dtypes.update({c: 'category' for c in CATEGORICAL_COLUMNS})
+    dtypes[value_col] = np.float64
+    with profiling.stage('loading'):
+        num_rows = 0
+        tested_list, chunk_list = [], []
+        with open_input(path) as handle:
+            for chunk in pd.read_table(handle, dtype=dtypes, chunksize=CHUNK_ROWS,
+                                       usecols=_project_columns(path, RESULT_STR_COLUMNS + [value_col])):
+                num_rows += len(chunk)
+                tested_list.append(np.asarray(chunk['gene'].unique()))
+                if not is_rank:
+                    thresh_vals, score_val, is_low = threshold_values(chunk, method_name, config)
+                    chunk = chunk[thresh_vals <= score_val if is_low else thresh_vals >= score_val]
+                chunk_list.append(chunk)
+        profiling.record_read(path, rows=num_rows)
+        df = pd.concat(chunk_list, ignore_index=True)
+        # the categories of each chunk differ, so keep plain strings
+        for c in CATEGORICAL_COLUMNS:
+            df[c] = df[c].astype(object)
+        add_info_columns(df)
+    return {'genes': significant_genes(df, method_name, config, level=level),
+            'tested': pd.unique(np.concatenate(tested_list))}
+
 
-            # remove cases that have filter equals fail
-            signif_df = signif_df[~signif_df['info'].astype(str).str.contains('FILTER=FAIL|FILTER=LGF|FILTER=LDA')]
+def list_method_files(input_dir, method_name):
+    """Get the cancer type name and path of each result file for a method.
 
-            # append results
-            tmp_result |= set(signif_df[level].tolist())
-            signif_dict[cancer_type_name] = list(tmp_result)
+    Result files may be compressed, e.g. LUAD.txt.gz is read as the
+    LUAD cancer type.
+    """
+    file_list = []
+    meth_input_dir = os.path.join(input_dir, method_name)
+    for method_file in sorted(os.listdir(meth_input_dir)):
+        file_name = strip_compression_ext(method_file)
+        if not file_name.endswith('.txt'): continue
+        if file_name.upper().startswith('README'): continue
+        cancer_type_name = os.path.splitext(file_name)[0]
+        if cancer_type_name in [ct for ct, _ in file_list]:
+            raise ValueError('More than one result file for {0} in {1}'.format(cancer_type_name,
+                                                                               meth_input_dir))
+        full_path = os.path.join(meth_input_dir, method_file)
+        file_list.append((cancer_type_name, full_path))
+    return file_list
+
+
+def significant_genes(df, method_name, config, level='gene'):
+    """Apply the significance threshold of a method to its result data frame."""
+    with profiling.stage('thresholding'):
+        return _significant_genes(df, method_name, config, level=level)
+
+
+def threshold_values(df, method_name, config):
+    """Get the values a method's significance threshold is applied to.
+
+    Returns
+    -------
+    thresh_vals : pd.Series
+        threshold column, or the rank of the score for rank thresholds
+    score_val : float
+        configured threshold
+    is_low : bool
+        True if values at or below the threshold are significant, False
+        if values at or above it are
+    """
+    # get the treshold for significance
+    thresh_col, score_val, top_direction = cfg.fetch_threshold(config, method_name)
+
+    # work around for rank based selection
+    if thresh_col == 'rank':
+        rank_order = True if top_direction=='low' else False
+        thresh_vals = df['score'].rank(ascending=rank_order)
+    else:
+        thresh_vals = df[thresh_col].astype(float)
+
+    # figure out if a custom score or q-value is used
+    if cfg.is_valid_config(config, method_name, 'threshold'):
+        is_low = thresh_col == 'rank' or top_direction == 'low'
+    else:
+        # use q-value for threshold
+        is_low = True
+    return thresh_vals, score_val, is_low
+
+
+def is_filtered(df):
+    """Flag rows whose FILTER is FAIL, LGF or LDA.
+
+    Uses the FILTER column if there is one, so only the distinct FILTER
+    values are checked. The column is categorical when parsed from the
+    info column, but may also be a plain column of the result file.
+    """
+    if 'FILTER' not in df.columns:
+        df = add_info_columns(df[['info']].copy())
+    filters = df['FILTER']
+    if not pd.api.types.is_categorical_dtype(filters):
+        fail_filters = [f for f in filters.dropna().unique()
+                        if str(f).startswith(FAIL_FILTERS)]
+        return filters.isin(fail_filters)
+    is_fail = [str(f).startswith(FAIL_FILTERS) for f in filters.cat.categories]
+    # rows without a FILTER have code -1, i.e. the last entry
+    is_fail = np.array(is_fail + [False], dtype=bool)
+    return pd.Series(is_fail[filters.cat.codes.values], index=df.index)
+
+
+def _significant_genes(df, method_name, config, level):
+    thresh_vals, score_val, is_low = threshold_values(df, method_name, config)
+
+    # get the top scoring genes
+    if is_low:
+        signif_df = df[thresh_vals<=score_val]
+    else:
+        signif_df = df[thresh_vals>=score_val]
+
+    # remove cases that have filter equals fail
+    signif_df = signif_df[~is_filtered(signif_df)]
+
+    if level in KEY_LEVELS:
+        # only name the distinct significant variants/residues
+        codes, col_uniques = key_codes(signif_df)
+        return list(set(render_keys(np.unique(codes), col_uniques).tolist()))
+    return list(set(signif_df[LEVEL_COLUMNS.get(level, level)].tolist()))
+
+
+def significance_curve(df, method_name, config, thresholds,
+                       level='gene', driver_genes=None):
+    """Count the significant genes at each of many thresholds.
+
+    Each gene's best threshold value is sorted once, so the counts for
+    all thresholds come from a single searchsorted call. The count at
+    the configured threshold equals the number of genes returned by
+    significant_genes.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        parsed result file
+    method_name : str
+        name of the method
+    config : dict
+        parsed configuration file
+    thresholds : np.ndarray
+        thresholds to evaluate
+    level : str
+        gene, variant or residue level
+    driver_genes : set or None
+        driver genes to count the overlap with
+
+    Returns
+    -------
+    curve_df : pd.DataFrame
+        threshold, num_significant and, if driver genes are given,
+        num_overlap columns
+    """
+    with profiling.stage('thresholding'):
+        thresh_vals, score_val, is_low = threshold_values(df, method_name, config)
+        thresh_vals = thresh_vals.values
+        keep = ~is_filtered(df).values.astype(bool) & ~np.isnan(thresh_vals)
+
+        # value where each gene first becomes significant
+        if level in KEY_LEVELS:
+            codes, col_uniques = key_codes(df)
+            grouped = pd.Series(thresh_vals[keep]).groupby(codes[keep])
         else:
-            # use q-value for threshold
-            # get the significant genes
-            signif_df = df[df[thresh_col].astype(float)<=score_val]
-            # remove cases that have filter equals fail
-            signif_df = signif_df[~signif_df['info'].astype(str).str.contains('FILTER=FAIL|FILTER=LGF|FILTER=LDA')]
-            tmp_result |= set(signif_df[level].tolist())
-            signif_dict[cancer_type_name] = list(tmp_result)
-    return signif_dict
+            grouped = pd.Series(thresh_vals[keep]).groupby(level_names(df, level)[keep])
+        best_vals = grouped.min() if is_low else grouped.max()
+        if level in KEY_LEVELS:
+            best_vals.index = render_keys(best_vals.index.values, col_uniques)
+
+        thresholds = np.asarray(thresholds, dtype=float)
+        curve_df = pd.DataFrame({'threshold': thresholds},
+                                columns=['threshold'])
+        count_sets = [('num_significant', best_vals)]
+        if driver_genes is not None:
+            count_sets.append(('num_overlap', best_vals[best_vals.index.isin(driver_genes)]))
+        for col, vals in count_sets:
+            sorted_vals = np.sort(vals.values)
+            if is_low:
+                counts = np.searchsorted(sorted_vals, thresholds, side='right')
+            else:
+                counts = len(sorted_vals) - np.searchsorted(sorted_vals, thresholds, side='left')
+            curve_df[col] = counts
+    return curve_df
+
+
+def threshold_grid(df_dict, method_name, config, num_points):
+    """Choose the thresholds to sweep for a method.
+
+    P-values and q-values are spaced evenly on a log scale from the
+    smallest positive value up to 1, ranks and scores evenly over the
+    observed range. The configured threshold is always included.
+    """
+    thresh_col, score_val, top_direction = cfg.fetch_threshold(config, method_name)
+    all_vals = [threshold_values(df_dict[c], method_name, config)[0].values
+                for c in df_dict]
+    all_vals = np.concatenate(all_vals) if all_vals else np.array([])
+    all_vals = all_vals[~np.isnan(all_vals)]
+
+    if not len(all_vals):
+        grid = np.array([])
+    elif thresh_col in ['pvalue', 'qvalue']:
+        pos_vals = all_vals[all_vals > 0]
+        low = np.log10(pos_vals.min()) if len(pos_vals) else np.log10(score_val)
+        grid = np.logspace(min(low, 0), 0, num_points)
+    elif thresh_col == 'rank':
+        grid = np.unique(np.round(np.linspace(1, all_vals.max(), num_points)))
+    else:
+        grid = np.linspace(all_vals.min(), all_vals.max(), num_points)
+    return np.unique(np.append(grid, score_val))
 
 
 def read_method_overlap_genes(path, min_methods):
     # read data
-    df = pd.read_table(path)
+    with open_input(path) as handle:
+        df = pd.read_table(handle)
 
     # add up all genes with min overlap
     gene_list = []
@@ -190,7 +691,9 @@ def read_method_overlap_genes(path, min_methods):
 def process_cgc(path):
     """Get the list of CGC genes with small somatic variants."""
     # read in data
-    df = pd.read_table(path)
+    with open_input(path) as handle:
+        df = pd.read_table(handle)
+    profiling.record_read(path, rows=len(df))
 
     # keep small somatic variants
     s = df['Mutation Types']
@@ -204,73 +707,320 @@ def process_cgc(path):
     return cgc_genes
 
 
-def fetch_raw_dataframes(input_dir, method_name):
-    data_dict = {}
-    meth_input_dir = os.path.join(input_dir, method_name)
-    for method_file in os.listdir(meth_input_dir):
-        #method_name = os.path.splitext(method_file)[0]
-        cancer_type = os.path.splitext(method_file)[0]
+def significant_cell(df, method_name, config, level='gene'):
+    """Get the significant genes and all reported genes of a single
+    result file, which is what later stages need from it."""
+    return {'genes': significant_genes(df, method_name, config, level=level),
+            'tested': df['gene'].unique()}
 
-        # skip READMEs
-        if method_file.upper().startswith('README'): continue
 
-        # read in data
-        full_path = os.path.join(meth_input_dir, method_file)
-        df = pd.read_table(full_path)
-        df['variant'] = df['gene'] + '_' +df['transcript'] + '_' + df['protein_change'].astype(str)
+def _significant_worker(task):
+    """Find the significant genes of a single result file.
+
+    Run by the process pool in ResultStore.fetch_significant.
+    """
+    method_name, cancer_type, full_path, config, level, cache = task
+    with profiling.collect_reads() as reads:
+        cell = read_significant_cell(full_path, method_name, config,
+                                     level=level, cache=cache)
+    return method_name, cancer_type, cell, reads
 
-        #data_dict[method_name] = df
-        data_dict[cancer_type] = df
 
-    return data_dict
+class ResultStore(object):
+    """Loads each method result file once and serves it from memory.
 
+    Significant genes, reported genes and raw data frames are all derived
+    from the same parsed data, so sub-commands sharing a store never read
+    a result file twice.
 
-def fetch_filtered_dataframes(input_dir, blacklist, method):
-    """Return the result files for each method as a dataframe, but with certain
-    genes filtered out. This includes those agreed upon by some minimum
-    number of methods or from the CGC.
+    Parameters
+    ----------
+    input_dir : str
+        directory containing a sub-directory of results for each method
+    config : dict
+        parsed configuration file
+    cache : frame_cache.FrameCache or None
+        optional on-disk cache of parsed result files
+    jobs : int
+        number of processes used to find significant genes
+    manifest : run_manifest.RunManifest or None
+        optional run manifest, results of (method, cancer type) cells
+        whose inputs did not change since the last run are reused
     """
-    # get the raw results
-    df_dict = fetch_raw_dataframes(input_dir, method)
 
-    # gene column name
-    gene = 'gene'
-    # iterate over each method
-    for ctype in df_dict:
-        # filter out agreed upon genes
-        df_copy = df_dict[ctype].copy()
-        df_copy = df_copy[~df_copy[gene].isin(blacklist)]
+    def __init__(self, input_dir, config, cache=None, jobs=1, manifest=None):
+        self.input_dir = input_dir
+        self.config = config
+        self.cache = cache
+        self.jobs = jobs
+        self.manifest = manifest
+        self._frames = {}
+        self._significant = {}
+        self._tested = {}
+        self._call_matrix = {}
 
-        # update dictionary
-        df_dict[ctype] = df_copy
+        # gene symbols are interned in a table shared by everything using
+        # this store
+        self.gene_index = gene_sets.GeneIndex()
 
-    return df_dict
+        # locks so stages running in separate threads never load the same
+        # data twice
+        self._lock = threading.Lock()
+        self._key_locks = {}
 
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
 
-def read_filtered_pvalues(input_dir, blacklist, config, method_name):
-    """Get p-values without 'likely' driver genes"""
-    df_dict = fetch_raw_dataframes(input_dir, method_name)
+    def _read_frame(self, method_name, full_path, level='gene'):
+        """Get a parsed result file, reading it only once.
 
-    # gene column name
-    if cfg.is_valid_config(config, method_name, 'gene_col'):
-        gene = config[method_name]['gene_col']
-    else:
-        gene = 'gene'
+        Only the columns used for the method are read, see method_columns.
+        """
+        key = self._frame_key(full_path, level)
+        with self._key_lock(('frames',) + key):
+            if key not in self._frames:
+                usecols = method_columns(self.config, method_name) if self.config is not None else None
+                self._frames[key] = read_method_file(full_path, level=level,
+                                                     cache=self.cache, usecols=usecols)
+        return self._frames[key]
 
-    # pvalue column
-    if cfg.is_valid_config(config, method_name, 'pvalue'):
-        pval_col = config[method_name]['pvalue'][0]
-    else:
-        pval_col = 'pvalue'
+    @staticmethod
+    def _frame_key(full_path, level='gene'):
+        return (full_path, 'residue' if level == 'residue' else 'table')
+
+    def cached_frame(self, method_name, full_path, level='gene'):
+        """Get a parsed result file if it is in memory or in the frame
+        cache, without reading the file. Returns None otherwise."""
+        df = self._frames.get(self._frame_key(full_path, level))
+        if df is None and self.cache is not None:
+            usecols = method_columns(self.config, method_name) if self.config is not None else None
+            with profiling.stage('loading'):
+                df = self.cache.get(full_path, frame_kind(level, usecols))
+        return df
+
+    def _significant_cell(self, method_name, full_path, level='gene'):
+        """Find the significant genes of a result file, using the parsed
+        file if it is in memory, or else see read_significant_cell."""
+        df = self._frames.get(self._frame_key(full_path, level))
+        if df is None:
+            return read_significant_cell(full_path, method_name, self.config,
+                                         level=level, cache=self.cache)
+        return significant_cell(df, method_name, self.config, level=level)
+
+    def fetch_raw_dataframes(self, method_name, level='gene'):
+        """Get the parsed result file for each cancer type of a method."""
+        return {cancer_type: self._read_frame(method_name, full_path, level=level)
+                for cancer_type, full_path in list_method_files(self.input_dir, method_name)}
+
+    def memoize_cells(self, stage_name, method_list, func, level='gene',
+                      extra='', load=True):
+        """Compute a result for every (method, cancer type) cell.
+
+        func gets a dict of parsed result files (or their paths, if load
+        is False) keyed by (method, cancer type) and returns a dict of
+        results with the same keys. With a run manifest, results of cells
+        whose inputs did not change are reused, and func only gets the
+        other cells.
+
+        Parameters
+        ----------
+        stage_name : str
+            name under which the cell results are cached
+        method_list : list
+            methods to compute cells for
+        func : function
+            computes the results of many cells
+        level : str
+            level at which result files are parsed
+        extra : str
+            digest of any other inputs of func, e.g. a gene list
+        load : bool
+            pass parsed result files to func, rather than paths
+
+        Returns
+        -------
+        cell_dict : dict
+            result of each (method, cancer type) cell
+        """
+        files = [((method_name, cancer_type), full_path)
+                 for method_name in method_list
+                 for cancer_type, full_path in list_method_files(self.input_dir, method_name)]
+        read = lambda cell, full_path: self._read_frame(cell[0], full_path, level=level) if load else full_path
+        if self.manifest is None:
+            return func({cell: read(cell, full_path) for cell, full_path in files})
+
+        # reuse the results of unchanged cells
+        cell_keys = {cell: self.manifest.cell_key(stage_name, cell[0], full_path,
+                                                  level=level, extra=extra)
+                     for cell, full_path in files}
+        cell_dict = {}
+        for cell in cell_keys:
+            value = self.manifest.get(stage_name, cell_keys[cell])
+            if value is not None:
+                cell_dict[cell] = value
+        logger.debug('Reusing {0} of {1} {2} results'.format(len(cell_dict), len(files), stage_name))
+
+        # compute the rest
+        missing = {cell: read(cell, full_path) for cell, full_path in files
+                   if cell not in cell_dict}
+        if missing:
+            new_cells = func(missing)
+            for cell in new_cells:
+                self.manifest.put(stage_name, cell_keys[cell], new_cells[cell])
+            cell_dict.update(new_cells)
+        self._record_cells(stage_name, method_list, cell_keys)
+        return cell_dict
+
+    def _record_cells(self, stage_name, method_list, cell_keys):
+        """Record the cell keys of methods in the run manifest."""
+        for method_name in method_list:
+            self.manifest.record_cells(stage_name, method_name,
+                                       {cell[1]: cell_keys[cell] for cell in cell_keys
+                                        if cell[0] == method_name})
+        self.manifest.save()
+
+    def fetch_single_method_significant(self, method_name, level='gene',
+                                        thresholds=None, driver_genes=None):
+        """Get the significant genes for each cancer type of a method.
+
+        If thresholds are given, a threshold sweep is done instead and a
+        curve of the number of significant genes (and the overlap with
+        driver_genes) is returned for each cancer type, see
+        significance_curve.
+        """
+        if thresholds is not None:
+            df_dict = self.fetch_raw_dataframes(method_name, level=level)
+            return {cancer_type: significance_curve(df_dict[cancer_type], method_name,
+                                                    self.config, thresholds, level=level,
+                                                    driver_genes=driver_genes)
+                    for cancer_type in df_dict}
+
+        key = (method_name, level)
+        with self._key_lock(('significant',) + key):
+            if key not in self._significant:
+                func = lambda path_dict: {cell: self._significant_cell(method_name, path_dict[cell],
+                                                                       level=level)
+                                          for cell in path_dict}
+                cell_dict = self.memoize_cells('significant', [method_name], func,
+                                               level=level, load=False)
+                self._publish_cells(key, {cell[1]: cell_dict[cell] for cell in cell_dict})
+        # copy so callers can modify the result
+        return dict(self._significant[key])
+
+    def _publish_cells(self, key, cell_dict):
+        """Store the significant and reported genes of a method's cells."""
+        with self._lock:
+            self._significant.setdefault(key, {cancer_type: cell_dict[cancer_type]['genes']
+                                               for cancer_type in cell_dict})
+            self._tested.setdefault(key, {cancer_type: cell_dict[cancer_type]['tested']
+                                          for cancer_type in cell_dict})
+
+    def fetch_tested_genes(self, method_name, level='gene'):
+        """Get the genes reported in each result file of a method,
+        whether significant or not."""
+        key = (method_name, level)
+        if key not in self._tested:
+            self.fetch_single_method_significant(method_name, level=level)
+        return self._tested[key]
+
+    def fetch_significant(self, level='gene'):
+        """Get the significant genes for each method."""
+        method_list = cfg.fetch_level_names(self.config, level=level)
+        if self.jobs > 1:
+            self._fetch_significant_parallel(method_list, level)
+        signif_dict = {}
+        for method_name in method_list:
+            signif_dict[method_name] = self.fetch_single_method_significant(method_name,
+                                                                            level=level)
+        return signif_dict
+
+    def fetch_call_matrix(self, level='gene'):
+        """Get the significant genes of all methods as a CallMatrix."""
+        with self._key_lock(('call_matrix', level)):
+            if level not in self._call_matrix:
+                method_list = cfg.fetch_level_names(self.config, level=level)
+                signif_dict = self.fetch_significant(level=level)
+                self._call_matrix[level] = call_matrix.CallMatrix.from_signif_dict(signif_dict,
+                                                                                   methods=method_list,
+                                                                                   gene_index=self.gene_index)
+        return self._call_matrix[level]
+
+    def _fetch_significant_parallel(self, method_list, level):
+        """Find the significant genes of many methods using a process pool."""
+        method_list = [m for m in method_list if (m, level) not in self._significant]
+        if not method_list:
+            return
+        func = lambda path_dict: self._significant_pool(path_dict, level)
+        cell_dict = self.memoize_cells('significant', method_list, func,
+                                       level=level, load=False)
+
+        # only publish complete results, in the order of the result files
+        # like fetch_single_method_significant does
+        for method_name in method_list:
+            path_dict = {(method_name, cancer_type): full_path
+                         for cancer_type, full_path in list_method_files(self.input_dir, method_name)}
+            self._publish_cells((method_name, level),
+                                {cell[1]: cell_dict[cell] for cell in path_dict})
+
+    def _significant_pool(self, path_dict, level):
+        """Find the significant genes of many result files in a process pool.
+
+        Files are submitted largest first, so big files like PANCAN.txt
+        do not end up running last.
+        """
+        # frames already in memory are not read again
+        cell_dict = {}
+        tasks = []
+        for cell in path_dict:
+            df = self._frames.get(self._frame_key(path_dict[cell], level))
+            if df is not None:
+                cell_dict[cell] = significant_cell(df, cell[0], self.config, level=level)
+            else:
+                tasks.append((cell[0], cell[1], path_dict[cell], self.config, level, self.cache))
+        tasks.sort(key=lambda t: os.path.getsize(t[2]), reverse=True)
+        if not tasks:
+            return cell_dict
+
+        logger.info('Reading {0} result files with {1} processes . . .'.format(len(tasks), self.jobs))
+        with profiling.child_cpu('loading'):
+            pool = multiprocessing.Pool(self.jobs)
+            try:
+                for method_name, cancer_type, cell, reads in pool.imap_unordered(_significant_worker, tasks):
+                    cell_dict[(method_name, cancer_type)] = cell
+                    profiling.add_reads(reads)
+            finally:
+                pool.close()
+                pool.join()
+        return cell_dict
+
+
+def open_result_store(opts, config):
+    """Create a result store from the command line options."""
+    cache = frame_cache.open_cache(opts.get('cache_dir'),
+                                   rebuild=opts.get('rebuild_cache', False),
+                                   clear=opts.get('clear_cache', False))
+    manifest = run_manifest.open_manifest(opts, config)
+    return ResultStore(opts['input_dir'], config, cache=cache,
+                       jobs=opts.get('jobs', 1), manifest=manifest)
+
+
+def fetch_significant(input_dir, config, level='gene', cache=None):
+    """Read the significant driver genes for each method."""
+    store = ResultStore(input_dir, config, cache=cache)
+    return store.fetch_significant(level=level)
+
+
+def fetch_single_method_significant(input_dir, method_name, config,
+                                    level='gene', cache=None):
+    """Read the significant driver genes for a single method."""
+    store = ResultStore(input_dir, config, cache=cache)
+    return store.fetch_single_method_significant(method_name, level=level)
 
-    # get pvalues
-    pval_dict = {}
-    for cancer_type in df_dict:
-        tmp = df_dict[cancer_type]
-        tmp = tmp[~tmp[gene].isin(blacklist)]
-        pval_dict[cancer_type] = tmp[[pval_col]]
 
-    return pval_dict
+def fetch_raw_dataframes(input_dir, method_name, cache=None):
+    store = ResultStore(input_dir, None, cache=cache)
+    return store.fetch_raw_dataframes(method_name)
 
 
 def load_config(path):